@@ -1,6 +1,7 @@
-import requests
+from ..services.http_client import get_client
+from ..services.resilience import get_guard, UPLOAD_BUDGET_SHARE
 
-def upload_image_to_freeimage(image_data, name=None):
+async def upload_image_to_freeimage(image_data, name=None):
     """
     Upload an image to freeimage.host and return the URL.
     Args:
@@ -25,7 +26,12 @@ def upload_image_to_freeimage(image_data, name=None):
         payload['name'] = name
 
     try:
-        response = requests.post(url, data=payload, files=files)
+        # The upload only gets part of the request deadline: the search still follows
+        response = await get_guard("freeimage").call(
+            lambda **kwargs: get_client("freeimage").post(url, data=payload, files=files, **kwargs),
+            endpoint="upload",
+            share=UPLOAD_BUDGET_SHARE,
+        )
         response.raise_for_status()
         
         result = response.json()
@@ -1,14 +1,265 @@
 # apis/inditex_api.py
-import requests
+import asyncio
 import json
-from datetime import datetime, timedelta
+import os
+import threading
+import time
+
+import httpx
 from config import CLIENT_ID, CLIENT_SECRET, TOKEN_URL  # Import from config
 
+from ..services.http_client import get_client
+from ..services.rate_governor import get_governor, request_priority, RateLimitExceeded, BACKGROUND
+from ..services.resilience import get_guard, TOKEN_BUDGET_SHARE
+
+# Margen de seguridad: el token se considera caducado 60 s antes de su expiración real
+TOKEN_EXPIRY_MARGIN = int(os.getenv("INDITEX_TOKEN_EXPIRY_MARGIN", "60"))
+# Con cuánta antelación (en segundos) se renueva el token en segundo plano
+TOKEN_REFRESH_AHEAD = int(os.getenv("INDITEX_TOKEN_REFRESH_AHEAD", "300"))
+
+
+class TokenManager:
+    """
+    Gestor del token OAuth 2.0 de Inditex compartido por todo el proceso.
+
+    El token se guarda en memoria y se reutiliza entre peticiones. Cuando está
+    cerca de caducar se renueva en segundo plano mientras se sigue sirviendo el
+    token actual; si ya ha caducado, sólo una llamada hace la renovación y el
+    resto espera su resultado (single-flight). Es seguro tanto desde hilos como
+    desde corrutinas de asyncio; las corrutinas usan el cliente HTTP asíncrono
+    compartido y nunca bloquean el bucle de eventos.
+    """
+
+    def __init__(self,
+                 scope="technology.catalog.read",
+                 user_agent="cMatch",
+                 refresh_ahead=TOKEN_REFRESH_AHEAD,
+                 expiry_margin=TOKEN_EXPIRY_MARGIN):
+        """
+        Args:
+            scope: Alcance (scope) solicitado.
+            user_agent: Valor para la cabecera User-Agent.
+            refresh_ahead: Segundos antes de la caducidad en los que se lanza la
+                renovación en segundo plano.
+            expiry_margin: Segundos que se restan a ``expires_in`` por seguridad.
+        """
+        self.token_url = TOKEN_URL
+        self.client_id = CLIENT_ID
+        self.client_secret = CLIENT_SECRET
+        self.scope = scope
+        self.user_agent = user_agent
+        self.refresh_ahead = refresh_ahead
+        self.expiry_margin = expiry_margin
+
+        self._token = None
+        self._expires_at = 0.0   # time.monotonic() a partir del cual el token no es válido
+        self._refresh_at = 0.0   # time.monotonic() a partir del cual se renueva en segundo plano
+
+        self._state_lock = threading.Lock()    # protege el estado y los contadores
+        self._refresh_lock = threading.Lock()  # una única renovación a la vez (camino síncrono)
+        self._background_refresh = False
+        self._inflight = None                  # renovación asíncrona en curso (asyncio.Task)
+
+        self.hits = 0
+        self.refreshes = 0
+        self.background_refreshes = 0
+        self.failures = 0
+        self.waits = 0
+
+    def _cached_token(self, now):
+        """Devuelve el token si sigue siendo válido, o None. Requiere ``_state_lock``."""
+        if self._token and now < self._expires_at:
+            return self._token
+        return None
+
+    def get_token(self):
+        """
+        Obtiene un token de acceso válido (bloqueante).
+
+        Pensado para scripts y código síncrono; dentro de la aplicación se usa
+        :meth:`aget_token`.
+
+        Returns:
+            str: El token de acceso (Bearer token), o None si no se pudo obtener.
+        """
+        with self._state_lock:
+            token = self._cached_token(time.monotonic())
+            if token:
+                self.hits += 1
+                return token
+
+        with self._refresh_lock:
+            with self._state_lock:
+                token = self._cached_token(time.monotonic())
+                if token:
+                    # Otra llamada renovó el token mientras esperábamos el lock
+                    self.waits += 1
+                    return token
+            try:
+                response = httpx.post(self.token_url, **self._token_request())
+            except httpx.HTTPError as e:
+                print(f"Error obteniendo token de Inditex API: {e}")
+                return self._record_failure()
+            return self._handle_token_response(response)
+
+    async def aget_token(self):
+        """
+        Obtiene un token de acceso válido sin bloquear el bucle de eventos.
+
+        Si el token está próximo a caducar se lanza su renovación en segundo
+        plano y se devuelve el actual; si ya caducó, todas las corrutinas
+        esperan a la misma renovación.
+
+        Returns:
+            str: El token de acceso (Bearer token), o None si no se pudo obtener.
+        """
+        now = time.monotonic()
+        with self._state_lock:
+            token = self._cached_token(now)
+            if token:
+                self.hits += 1
+                refresh_ahead = now >= self._refresh_at and not self._background_refresh
+                if refresh_ahead:
+                    self._background_refresh = True
+        if token:
+            if refresh_ahead:
+                # La renovación anticipada cede el paso a las búsquedas de los usuarios
+                with request_priority(BACKGROUND):
+                    asyncio.ensure_future(self._refresh_in_background())
+            return token
+        return await self._refresh_shared()
+
+    def invalidate(self):
+        """Descarta el token actual (por ejemplo, tras un 401 de la API)."""
+        with self._state_lock:
+            self._token = None
+            self._expires_at = 0.0
+            self._refresh_at = 0.0
+
+    def stats(self):
+        """Contadores de uso del token."""
+        with self._state_lock:
+            return {
+                "hits": self.hits,
+                "refreshes": self.refreshes,
+                "background_refreshes": self.background_refreshes,
+                "failures": self.failures,
+                "waits": self.waits,
+                "valid_for": max(0.0, round(self._expires_at - time.monotonic(), 1)) if self._token else 0.0,
+            }
+
+    async def _refresh_shared(self):
+        """Renueva el token; si ya hay una renovación en curso, espera su resultado."""
+        task = self._inflight
+        if task is None or task.done():
+            task = self._inflight = asyncio.ensure_future(self._refresh())
+        else:
+            with self._state_lock:
+                self.waits += 1
+        # shield: si una petición se cancela, la renovación sigue para el resto
+        return await asyncio.shield(task)
+
+    async def _refresh_in_background(self):
+        try:
+            if await self._refresh_shared():
+                with self._state_lock:
+                    self.background_refreshes += 1
+        finally:
+            with self._state_lock:
+                self._background_refresh = False
+
+    def _token_request(self):
+        """Argumentos comunes de la petición de token (client credentials)."""
+        return {
+            "headers": {
+                "User-Agent": self.user_agent
+            },
+            "auth": (self.client_id, self.client_secret),
+            "data": {
+                "grant_type": "client_credentials",
+                "scope": self.scope
+            },
+        }
+
+    async def _refresh(self):
+        """Pide un token nuevo a la API de Inditex usando el cliente compartido."""
+        try:
+            response = await get_governor("token").send(
+                lambda: get_guard("inditex").call(
+                    lambda **kwargs: get_client("inditex").post(self.token_url, **self._token_request(), **kwargs),
+                    endpoint="token",
+                    share=TOKEN_BUDGET_SHARE,
+                )
+            )
+        except (httpx.HTTPError, RateLimitExceeded) as e:
+            print(f"Error obteniendo token de Inditex API: {e}")
+            return self._record_failure()
+        return self._handle_token_response(response)
+
+    def _handle_token_response(self, response):
+        try:
+            response.raise_for_status()
+            token_data = response.json()
+            token = token_data["id_token"]
+            expires_in = token_data["expires_in"]
+        except httpx.HTTPError as e:
+            print(f"Error obteniendo token de Inditex API: {e}")
+            return self._record_failure()
+        except KeyError as e:
+            print(f"Error: La respuesta de la API no contiene el campo esperado: {e}")
+            print(f"Respuesta completa: {response.text}")
+            return self._record_failure()
+        except json.JSONDecodeError:
+            print(f"Error al decodificar la respuesta JSON. Respuesta: {response.text}")
+            return self._record_failure()
+        except Exception as e:  # para cubrir más casos
+            print(f"Error durante la autenticacion: {e}")
+            return self._record_failure()
+
+        self._store(token, expires_in)
+        return token
+
+    def _store(self, token, expires_in):
+        now = time.monotonic()
+        # Calculamos el tiempo de expiración (con un pequeño margen de seguridad)
+        lifetime = max(expires_in - self.expiry_margin, expires_in / 2)
+        with self._state_lock:
+            self._token = token
+            self._expires_at = now + lifetime
+            self._refresh_at = now + max(lifetime - self.refresh_ahead, lifetime / 2)
+            self.refreshes += 1
+
+    def _record_failure(self):
+        with self._state_lock:
+            self.failures += 1
+        return None
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager(scope="technology.catalog.read", user_agent="cMatch"):
+    """
+    Devuelve el :class:`TokenManager` compartido para ``(scope, user_agent)``,
+    creándolo la primera vez.
+    """
+    key = (scope, user_agent)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = _managers[key] = TokenManager(scope=scope, user_agent=user_agent)
+        return manager
+
 
 class InditexAPI:
     """
     Clase para interactuar con la API de Inditex, incluyendo la obtención y
     gestión del token de acceso OAuth 2.0.
+
+    El token se comparte entre todas las instancias a través de
+    :func:`get_token_manager`, así que crear una instancia por petición no
+    obliga a autenticarse de nuevo.
     """
 
     def __init__(self,
@@ -27,8 +278,7 @@ class InditexAPI:
         self.client_secret = CLIENT_SECRET
         self.scope = scope
         self.user_agent = user_agent
-        self._token = None  
-        self._token_expiration = None  
+        self._token_manager = get_token_manager(scope, user_agent)
 
 
     def get_token(self):
@@ -40,44 +290,8 @@ class InditexAPI:
             str: El token de acceso (Bearer token) si se obtiene correctamente,
                  o None si hay un error.
         """
+        return self._token_manager.get_token()
 
-        if self._token and self._token_expiration and datetime.now() < self._token_expiration:
-            #print("Usando token existente.")  # Para debugging
-            return self._token
-
-        #  Necesitamos (re)autenticar:
-        headers = {
-            "User-Agent": self.user_agent
-        }
-        auth = (self.client_id, self.client_secret)
-        data = {
-            "grant_type": "client_credentials",
-            "scope": self.scope
-        }
-
-        try:
-            response = requests.post(self.token_url, headers=headers, auth=auth, data=data)
-            response.raise_for_status()  
-            token_data = response.json()
-
-            self._token = token_data["id_token"]
-            expires_in = token_data["expires_in"] 
-
-            # Calculamos el tiempo de expiración (con un pequeño margen de seguridad)
-            self._token_expiration = datetime.now() + timedelta(seconds=expires_in - 60)  # Restamos 60 segundos
-            return self._token
-
-
-        except requests.exceptions.RequestException as e:
-            print(f"Error obteniendo token de Inditex API: {e}")
-            return None
-        except KeyError as e:
-            print(f"Error: La respuesta de la API no contiene el campo esperado: {e}")
-            print(f"Respuesta completa: {response.text}")  # Imprime la respuesta completa
-            return None
-        except json.JSONDecodeError:
-            print(f"Error al decodificar la respuesta JSON. Respuesta: {response.text}")
-            return  None
-        except Exception as e: # para cubrir más casos
-            print(f"Error durante la autenticacion: {e}")
-            return None
\ No newline at end of file
+    async def aget_token(self):
+        """Versión asíncrona de :meth:`get_token`."""
+        return await self._token_manager.aget_token()
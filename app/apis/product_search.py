@@ -1,13 +1,85 @@
 # product_search.py
-from .inditex_api import InditexAPI
-import requests
+from .inditex_api import get_token_manager
+from ..services.http_client import get_client, record_quota
+from ..services.cache import TTLCache
+from ..services.catalog import ingest_products
+from ..services.singleflight import SingleFlight
+from ..services.rate_governor import get_governor, RateLimitExceeded
+from ..services.resilience import get_guard, DeadlineExceeded
+from ..services.search_history import note_cache_lookup
+from models.product import ProductBatch
+import httpx
 from config import PRODUCT_SEARCH_BASE_URL  # Import the correct base URL
+import asyncio
 import json
+import os
 
+# Results are cached by normalized (query, brand, page, per_page). Entries are
+# fresh for SEARCH_CACHE_TTL seconds and may be served stale for another
+# SEARCH_CACHE_STALE_TTL seconds while they are refreshed in the background.
+search_cache = TTLCache(
+    "product_search",
+    maxsize=int(os.getenv("SEARCH_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("SEARCH_CACHE_TTL", "300")),
+    stale_ttl=float(os.getenv("SEARCH_CACHE_STALE_TTL", "1800")),
+)
+# Identical searches in flight at the same time share one upstream call
+search_flights = SingleFlight("product_search")
 
-def search_products(query, brand, page=1, per_page=5):
+# Brands searched for brand=all, and how long a multi-brand search waits for
+# each brand before answering without it
+INDITEX_BRANDS = [
+    b.strip().lower()
+    for b in os.getenv("INDITEX_BRANDS", "zara,pullandbear,bershka,stradivarius,massimodutti,oysho").split(",")
+    if b.strip()
+]
+MULTI_BRAND_TIMEOUT = float(os.getenv("MULTI_BRAND_TIMEOUT", "4"))
+
+
+def normalize_query(query):
+    """Lowercase ``query`` and collapse whitespace."""
+    return " ".join((query or "").lower().split())
+
+
+def search_cache_key(query, brand, page, per_page):
+    return (normalize_query(query), (brand or "").strip().lower(), int(page), int(per_page))
+
+
+async def search_products(query, brand, page=1, per_page=5):
+    """
+    Search products with pagination, serving repeated searches from ``search_cache``.
+    
+    Args:
+        query (str): Search term for the product
+        brand (str): Brand to search in (e.g., 'zara')
+        page (int): Page number for pagination
+        per_page (int): Number of results per page
+        
+    Returns:
+        dict: JSON response containing product results or None if error
     """
-    Search products with pagination using the InditexAPI class for authentication.
+    key = search_cache_key(query, brand, page, per_page)
+    normalized_query, normalized_brand = key[0], key[1] or None
+    note_cache_lookup(key in search_cache)
+
+    async def load():
+        try:
+            return await search_flights.do(
+                key,
+                lambda: fetch_products(normalized_query, normalized_brand, page=page, per_page=per_page)
+            )
+        except DeadlineExceeded as e:
+            # Same outcome as an upstream timeout inside fetch_products
+            print(f"Error en Product Search: {e}")
+            return None
+
+    return await search_cache.get_or_load(key, load)
+
+
+async def fetch_products(query, brand, page=1, per_page=5):
+    """
+    Search products with pagination using the shared Inditex token manager for authentication.
+    Always calls the upstream API; use :func:`search_products` to go through the cache.
     
     Args:
         query (str): Search term for the product
@@ -18,8 +90,7 @@ def search_products(query, brand, page=1, per_page=5):
     Returns:
         dict: JSON response containing product results or None if error
     """
-    api = InditexAPI()
-    token = api.get_token()
+    token = await get_token_manager().aget_token()
     
     if not token:
         print("Error: Could not obtain authentication token.")
@@ -32,27 +103,114 @@ def search_products(query, brand, page=1, per_page=5):
     }
     params = {
         "query": query,
-        "brand": brand,
         "page": page,
         "perPage": per_page
     }
+    if brand:
+        params["brand"] = brand
 
     try:
-        # Use VISUAL_SEARCH_BASE_URL,  OR  create and use a separate PRODUCT_SEARCH_BASE_URL in config.py
-        response = requests.get(PRODUCT_SEARCH_BASE_URL, headers=headers, params=params)  # Or your product search URL
+        # Waits for the rate governor and retries 429 responses; the guard applies
+        # the request deadline and the Inditex circuit breaker
+        governor = get_governor("product_search")
+        response = await governor.send(
+            lambda: get_guard("inditex").call(
+                lambda **kwargs: get_client("inditex").get(
+                    PRODUCT_SEARCH_BASE_URL, headers=headers, params=params, **kwargs
+                ),
+                endpoint="product_search",
+                idempotent=True,
+                admit=governor.try_acquire,
+            )
+        )
+        record_quota("inditex", response)
         response.raise_for_status()
-        print(response.json)
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        results = response.json()
+        ingest_products(results, brand)
+        return results
+    except httpx.HTTPError as e:
+        print(f"Error en Product Search: {e}")
+        return None
+    except RateLimitExceeded as e:
         print(f"Error en Product Search: {e}")
         return None
     except json.JSONDecodeError:
         print(f"Error al decodificar JSON.  Respuesta: {response.text}")
         return None
 
+def parse_brands(brand):
+    """
+    Brands of a multi-brand search.
+
+    Args:
+        brand (str): A comma-separated list of brands, or ``all``.
+
+    Returns:
+        list: Normalized, de-duplicated brands, or None for a single-brand
+        (or brandless) search.
+    """
+    if not brand:
+        return None
+    if brand.strip().lower() == "all":
+        return list(INDITEX_BRANDS)
+    brands = []
+    for b in brand.split(","):
+        b = b.strip().lower()
+        if b and b not in brands:
+            brands.append(b)
+    return brands if len(brands) > 1 else None
+
+
+def _brand_status(task):
+    if task.cancelled() or task.exception() is not None:
+        return "error"
+    results = task.result()
+    if results is None:
+        return "error"
+    return "ok" if results else "empty"
+
+
+async def search_products_multi(query, brands, page=1, per_page=5, timeout=MULTI_BRAND_TIMEOUT):
+    """
+    Search several brands concurrently and merge the results.
+
+    Each brand gets ``timeout`` seconds. Brands that have not answered by
+    then are reported as ``timeout`` and left out of the response; their
+    searches keep running and land in ``search_cache`` for the next request.
+    Results are interleaved across brands (first of each brand, then second,
+    ...) and de-duplicated by product id or canonical link.
+
+    Returns:
+        dict: ``{"results": [...], "brands": {brand: "ok"|"empty"|"error"|"timeout"}}``
+    """
+    tasks = {
+        brand: asyncio.ensure_future(search_products(query, brand, page=page, per_page=per_page))
+        for brand in brands
+    }
+    done, pending = await asyncio.wait(tasks.values(), timeout=timeout)
+
+    statuses = {}
+    batches = []
+    for brand, task in tasks.items():
+        if task in pending:
+            # Nobody awaits it any more: retrieve its outcome so errors are not logged as unhandled
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            statuses[brand] = "timeout"
+            continue
+        statuses[brand] = _brand_status(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error en Product Search ({brand}): {task.exception()}")
+        if statuses[brand] == "ok":
+            batches.append(ProductBatch.from_inditex(task.result(), brand))
+
+    return {
+        "results": ProductBatch.interleave(batches).dedupe().to_list(),
+        "brands": statuses,
+    }
+
 # --- Example Usage (optional, for testing) ---
 if __name__ == '__main__':
-    results = search_products(query="t-shirt", brand="zara")
+    results = asyncio.run(search_products(query="t-shirt", brand="zara"))
     if results:
       print("Product Search Results:")
-      print(json.dumps(results, indent=2))
\ No newline at end of file
+      print(json.dumps(results, indent=2))
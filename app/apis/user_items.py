@@ -1,13 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Union
 from datetime import datetime
+import base64
 from sqlalchemy import text
 
-from ..database import get_db
-from ..models.database import User
+from ..database import get_async_db
 from .. import auth
-from pydantic import BaseModel
+from pydantic import BaseModel, validator
 
 router = APIRouter()
 
@@ -28,32 +28,181 @@ class Item(ItemBase):
     class Config:
         orm_mode = True
 
-# Helper function to get current user
-async def get_current_user(token: str = Depends(auth.oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
+class ItemPage(BaseModel):
+    items: List[Item]
+    next_cursor: Optional[str] = None
+
+# Bulk operations
+MAX_BULK_ITEMS = 500
+
+class BulkItemCreate(BaseModel):
+    items: List[ItemCreate]
+
+    @validator("items")
+    def check_size(cls, items):
+        if not 1 <= len(items) <= MAX_BULK_ITEMS:
+            raise ValueError(f"between 1 and {MAX_BULK_ITEMS} items are required")
+        return items
+
+class BulkItemIds(BaseModel):
+    item_ids: List[int]
+
+    @validator("item_ids")
+    def check_size(cls, item_ids):
+        if not 1 <= len(item_ids) <= MAX_BULK_ITEMS:
+            raise ValueError(f"between 1 and {MAX_BULK_ITEMS} item ids are required")
+        # Keep the caller's order but drop duplicates
+        return list(dict.fromkeys(item_ids))
+
+class BulkItemResult(BaseModel):
+    index: Optional[int] = None
+    item_id: Optional[int] = None
+    status: str
+    item: Optional[Item] = None
+
+class BulkResponse(BaseModel):
+    results: List[BulkItemResult]
+
+# Keyset pagination over (added_date, id), newest first
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def encode_cursor(added_date: datetime, item_id: int) -> str:
+    raw = f"{added_date.isoformat()}|{item_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        added_date, item_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(added_date), int(item_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def list_items(db: AsyncSession, table: str, user_id: int,
+                     limit: int, cursor: Optional[str], return_all: bool):
+    """
+    List the items of ``table`` ("wishlist" or "closet") for ``user_id``.
+
+    Returns a plain list when ``return_all`` is set, otherwise an
+    :class:`ItemPage` with at most ``limit`` items after ``cursor``.
+    """
+    id_column = f"{table}_id"
+    params = {"user_id": user_id}
+    keyset = ""
+    if cursor and not return_all:
+        params["cursor_date"], params["cursor_id"] = decode_cursor(cursor)
+        keyset = f"AND (added_date, {id_column}) < (:cursor_date, :cursor_id)"
+    page_limit = ""
+    if not return_all:
+        # One extra row tells us whether there is a next page
+        params["limit"] = limit + 1
+        page_limit = "LIMIT :limit"
+
+    # Use text() for consistent SQL formatting and map <table>_id to item_id
+    stmt = text(f"""
+        SELECT 
+            {id_column} as item_id,
+            user_id,
+            item_name,
+            item_description,
+            price,
+            added_date
+        FROM {table} 
+        WHERE user_id = :user_id {keyset}
+        ORDER BY added_date DESC, {id_column} DESC
+        {page_limit}
+    """)
+
+    result = await db.execute(stmt, params)
+    items = [dict(row) for row in result.mappings()]
+    if return_all:
+        return items
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor(last["added_date"], last["item_id"])
+    return {"items": items, "next_cursor": next_cursor}
+
+async def insert_items(db: AsyncSession, table: str, user_id: int, items: List[ItemCreate]):
+    """
+    Insert ``items`` into ``table`` with a single multi-row statement.
+
+    Does not commit. Returns the created rows in the same order as ``items``.
+    """
+    id_column = f"{table}_id"
+    stmt = text(f"""
+        INSERT INTO {table} (user_id, item_name, item_description, price)
+        SELECT :user_id, t.item_name, t.item_description, t.price
+        FROM unnest(
+            CAST(:item_names AS varchar[]),
+            CAST(:item_descriptions AS text[]),
+            CAST(:prices AS numeric[])
+        ) WITH ORDINALITY AS t(item_name, item_description, price, ord)
+        ORDER BY t.ord
+        RETURNING {id_column} as item_id, user_id, item_name, item_description, price, added_date
+    """)
+    result = await db.execute(
+        stmt,
+        {
+            "user_id": user_id,
+            "item_names": [item.item_name for item in items],
+            "item_descriptions": [item.item_description for item in items],
+            "prices": [item.price for item in items],
+        }
     )
+    # Ids come from a sequence in insertion order, so they follow ``items``
+    return sorted((dict(row) for row in result.mappings()), key=lambda row: row["item_id"])
+
+async def delete_items(db: AsyncSession, table: str, user_id: int, item_ids: List[int]):
+    """
+    Delete the given items of ``user_id`` from ``table`` in one statement.
+
+    Does not commit. Returns the deleted rows keyed by item id.
+    """
+    id_column = f"{table}_id"
+    stmt = text(f"""
+        DELETE FROM {table}
+        WHERE user_id = :user_id AND {id_column} = ANY(:item_ids)
+        RETURNING {id_column} as item_id, user_id, item_name, item_description, price, added_date
+    """)
+    result = await db.execute(stmt, {"user_id": user_id, "item_ids": item_ids})
+    return {row["item_id"]: dict(row) for row in result.mappings()}
+
+async def bulk_create(db: AsyncSession, table: str, user_id: int, items: List[ItemCreate]):
     try:
-        payload = auth.jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except auth.JWTError:
-        raise credentials_exception
-    
-    user = db.query(User).filter(User.email == email).first()
-    if user is None:
-        raise credentials_exception
-    return user
+        created = await insert_items(db, table, user_id, items)
+        await db.commit()
+    except Exception as e:
+        print(f"Error creating {table} items: {e}")  # Debug log
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"results": [
+        {"index": index, "item_id": row["item_id"], "status": "created", "item": row}
+        for index, row in enumerate(created)
+    ]}
+
+async def bulk_delete(db: AsyncSession, table: str, user_id: int, item_ids: List[int]):
+    try:
+        deleted = await delete_items(db, table, user_id, item_ids)
+        await db.commit()
+    except Exception as e:
+        print(f"Error deleting {table} items: {e}")  # Debug log
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"results": [
+        {"item_id": item_id, "status": "deleted" if item_id in deleted else "not_found"}
+        for item_id in item_ids
+    ]}
 
 # Wishlist endpoints
 @router.post("/wishlist/add", response_model=Item)
 async def create_wishlist_item(
     item: ItemCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.TokenUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     print(f"Received item data: {item}")  # Debug log
     
@@ -64,7 +213,7 @@ async def create_wishlist_item(
     """)
     
     try:
-        result = db.execute(
+        result = await db.execute(
             stmt,
             {
                 "user_id": current_user.user_id,
@@ -73,54 +222,41 @@ async def create_wishlist_item(
                 "price": item.price
             }
         )
-        db.commit()
-        item_data = dict(result.first())
+        await db.commit()
+        item_data = dict(result.mappings().first())
         print(f"Created item: {item_data}")  # Debug log
         return item_data
     except Exception as e:
         print(f"Error creating wishlist item: {e}")  # Debug log
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=str(e)
         )
 
-@router.get("/wishlist/list", response_model=List[Item])
+@router.get("/wishlist/list", response_model=Union[ItemPage, List[Item]])
 async def get_wishlist_items(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    return_all: bool = Query(False, alias="all", description="Return every item as a plain list (legacy clients)"),
+    current_user: auth.TokenUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    # Use text() for consistent SQL formatting and map wishlist_id to item_id
-    stmt = text("""
-        SELECT 
-            wishlist_id as item_id,
-            user_id,
-            item_name,
-            item_description,
-            price,
-            added_date
-        FROM wishlist 
-        WHERE user_id = :user_id 
-        ORDER BY added_date DESC
-    """)
-    
-    result = db.execute(stmt, {"user_id": current_user.user_id})
-    items = [dict(row) for row in result]
-    return items
+    return await list_items(db, "wishlist", current_user.user_id, limit, cursor, return_all)
 
 @router.delete("/wishlist/{item_id}")
 async def delete_wishlist_item(
     item_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.TokenUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    result = db.execute(
-        """DELETE FROM wishlist 
+    result = await db.execute(
+        text("""DELETE FROM wishlist 
         WHERE wishlist_id = :item_id AND user_id = :user_id
-        RETURNING wishlist_id""",
+        RETURNING wishlist_id"""),
         {"item_id": item_id, "user_id": current_user.user_id}
     )
-    db.commit()
+    await db.commit()
     
     if result.rowcount == 0:
         raise HTTPException(
@@ -129,12 +265,65 @@ async def delete_wishlist_item(
         )
     return {"message": "Item deleted successfully"}
 
+@router.post("/wishlist/bulk", response_model=BulkResponse)
+async def bulk_create_wishlist_items(
+    bulk: BulkItemCreate,
+    current_user: auth.TokenUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Add several items to the wishlist in one transaction."""
+    return await bulk_create(db, "wishlist", current_user.user_id, bulk.items)
+
+@router.post("/wishlist/bulk-delete", response_model=BulkResponse)
+async def bulk_delete_wishlist_items(
+    bulk: BulkItemIds,
+    current_user: auth.TokenUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Delete several wishlist items in one transaction."""
+    return await bulk_delete(db, "wishlist", current_user.user_id, bulk.item_ids)
+
+@router.post("/wishlist/move-to-closet", response_model=BulkResponse)
+async def move_wishlist_items_to_closet(
+    bulk: BulkItemIds,
+    current_user: auth.TokenUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Atomically move wishlist items to the closet: either every found item is
+    moved or nothing changes.
+    """
+    try:
+        deleted = await delete_items(db, "wishlist", current_user.user_id, bulk.item_ids)
+        moved_ids = [item_id for item_id in bulk.item_ids if item_id in deleted]
+        created = []
+        if moved_ids:
+            created = await insert_items(
+                db, "closet", current_user.user_id,
+                [ItemCreate(**deleted[item_id]) for item_id in moved_ids]
+            )
+        await db.commit()
+    except Exception as e:
+        print(f"Error moving items to closet: {e}")  # Debug log
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    closet_items = dict(zip(moved_ids, created))
+    return {"results": [
+        {
+            "item_id": item_id,
+            "status": "moved" if item_id in closet_items else "not_found",
+            "item": closet_items.get(item_id),
+        }
+        for item_id in bulk.item_ids
+    ]}
+
 # Closet endpoints
 @router.post("/closet/add", response_model=Item)
 async def create_closet_item(
     item: ItemCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.TokenUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     print(f"Received item data: {item}")  # Debug log
     
@@ -145,7 +334,7 @@ async def create_closet_item(
     """)
     
     try:
-        result = db.execute(
+        result = await db.execute(
             stmt,
             {
                 "user_id": current_user.user_id,
@@ -154,58 +343,63 @@ async def create_closet_item(
                 "price": item.price
             }
         )
-        db.commit()
-        item_data = dict(result.first())
+        await db.commit()
+        item_data = dict(result.mappings().first())
         print(f"Created item: {item_data}")  # Debug log
         return item_data
     except Exception as e:
         print(f"Error creating closet item: {e}")  # Debug log
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=str(e)
         )
 
-@router.get("/closet/list", response_model=List[Item])
+@router.get("/closet/list", response_model=Union[ItemPage, List[Item]])
 async def get_closet_items(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    return_all: bool = Query(False, alias="all", description="Return every item as a plain list (legacy clients)"),
+    current_user: auth.TokenUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    # Use text() for consistent SQL formatting and map closet_id to item_id
-    stmt = text("""
-        SELECT 
-            closet_id as item_id,
-            user_id,
-            item_name,
-            item_description,
-            price,
-            added_date
-        FROM closet 
-        WHERE user_id = :user_id 
-        ORDER BY added_date DESC
-    """)
-    
-    result = db.execute(stmt, {"user_id": current_user.user_id})
-    items = [dict(row) for row in result]
-    return items
+    return await list_items(db, "closet", current_user.user_id, limit, cursor, return_all)
 
 @router.delete("/closet/{item_id}")
 async def delete_closet_item(
     item_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: auth.TokenUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    result = db.execute(
-        """DELETE FROM closet 
+    result = await db.execute(
+        text("""DELETE FROM closet 
         WHERE closet_id = :item_id AND user_id = :user_id
-        RETURNING closet_id""",
+        RETURNING closet_id"""),
         {"item_id": item_id, "user_id": current_user.user_id}
     )
-    db.commit()
+    await db.commit()
     
     if result.rowcount == 0:
         raise HTTPException(
             status_code=404,
             detail="Item not found or not authorized to delete"
         )
-    return {"message": "Item deleted successfully"} 
\ No newline at end of file
+    return {"message": "Item deleted successfully"}
+
+@router.post("/closet/bulk", response_model=BulkResponse)
+async def bulk_create_closet_items(
+    bulk: BulkItemCreate,
+    current_user: auth.TokenUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Add several items to the closet in one transaction."""
+    return await bulk_create(db, "closet", current_user.user_id, bulk.items)
+
+@router.post("/closet/bulk-delete", response_model=BulkResponse)
+async def bulk_delete_closet_items(
+    bulk: BulkItemIds,
+    current_user: auth.TokenUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Delete several closet items in one transaction."""
+    return await bulk_delete(db, "closet", current_user.user_id, bulk.item_ids)
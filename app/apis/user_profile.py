@@ -1,20 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from typing import List
 import json
 
-from ..database import get_db
-from ..models.database import User
+from ..database import get_async_db
 from ..schemas import UserProfile, UserProfileUpdate
-from ..auth import get_current_user
+from ..auth import get_current_user, invalidate_user, TokenUser
+from ..services.ranking import ranker
+from ..services.recommendation_cache import recommendation_cache
 
 router = APIRouter()
 
 @router.get("/profile", response_model=UserProfile)
 async def get_user_profile(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: TokenUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get the current user's profile"""
     stmt = text("""
@@ -34,7 +35,7 @@ async def get_user_profile(
         WHERE user_id = :user_id
     """)
     
-    result = db.execute(stmt, {"user_id": current_user.user_id}).first()
+    result = (await db.execute(stmt, {"user_id": current_user.user_id})).mappings().first()
     if not result:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -48,8 +49,8 @@ async def get_user_profile(
 @router.put("/profile", response_model=UserProfile)
 async def update_user_profile(
     profile_update: UserProfileUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: TokenUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update the current user's profile"""
     try:
@@ -100,10 +101,13 @@ async def update_user_profile(
                 created_at
         """)
         
-        result = db.execute(stmt, params)
-        db.commit()
+        result = await db.execute(stmt, params)
+        await db.commit()
+        invalidate_user(current_user.email)
+        ranker.invalidate(current_user.user_id)
+        recommendation_cache.invalidate_user(current_user.user_id)
         
-        updated_profile = dict(result.first())
+        updated_profile = dict(result.mappings().first())
         
         # Convert usual_sizes JSON string back to dict
         if updated_profile['usual_sizes'] is None:
@@ -119,7 +123,7 @@ async def update_user_profile(
         return updated_profile
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Error updating profile: {str(e)}")  # Add logging for debugging
         raise HTTPException(
             status_code=500,
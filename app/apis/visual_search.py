@@ -1,19 +1,63 @@
 # visual_search.py
-from .inditex_api import InditexAPI
-import requests
+from .inditex_api import get_token_manager
+from ..services.http_client import get_client, record_quota
+from ..services.cache import TTLCache
+from ..services.catalog import ingest_products
+from ..services.singleflight import SingleFlight
+from ..services.rate_governor import get_governor, RateLimitExceeded
+from ..services.resilience import get_guard
+from ..services.search_history import note_cache_lookup
+import httpx
 from config import VISUAL_SEARCH_BASE_URL
 import json
+import os
 
-def search_by_image(image_url, page=1, per_page=5):
+# Results of searches by image URL, keyed by (image_url, page, per_page)
+url_search_cache = TTLCache(
+    "visual_url_search",
+    maxsize=int(os.getenv("VISUAL_URL_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("VISUAL_URL_CACHE_TTL", "600")),
+)
+
+# Identical visual searches in flight at the same time share one upstream call
+visual_flights = SingleFlight("visual_search")
+
+
+def url_search_cache_key(image_url, page, per_page):
+    return (image_url.strip(), int(page), int(per_page))
+
+
+async def search_by_image_url(image_url, page=1, per_page=5):
+    """
+    Búsqueda visual de una URL pública, pasando por ``url_search_cache``.
+    """
+    key = url_search_cache_key(image_url, page, per_page)
+    note_cache_lookup(key in url_search_cache)
+    return await url_search_cache.get_or_load(
+        key,
+        lambda: search_by_image(image_url, page=page, per_page=per_page)
+    )
+
+async def search_by_image(image_url, page=1, per_page=5):
+    """
+    Búsqueda visual con paginación. Las búsquedas idénticas simultáneas
+    comparten una sola llamada a Inditex (``visual_flights``).
     """
-    Búsqueda visual con paginación.
+    return await visual_flights.do(
+        url_search_cache_key(image_url, page, per_page),
+        lambda: fetch_by_image(image_url, page=page, per_page=per_page)
+    )
+
+
+async def fetch_by_image(image_url, page=1, per_page=5):
+    """
+    Búsqueda visual con paginación. Siempre llama a la API de Inditex.
     Args:
         image_url: URL of the image to search
         page: Page number for pagination
         per_page: Number of results per page
     """
-    api = InditexAPI()
-    token = api.get_token()
+    token = await get_token_manager().aget_token()
 
     if not token:
         print("Error: No se pudo obtener el token de autenticación.")
@@ -32,19 +76,35 @@ def search_by_image(image_url, page=1, per_page=5):
     }
 
     try:
-        response = requests.get(
-            VISUAL_SEARCH_BASE_URL,
-            headers=headers,
-            params=params
+        # Waits for the rate governor and retries 429 responses; the guard applies
+        # the request deadline, hedging and the Inditex circuit breaker
+        governor = get_governor("visual_search")
+        response = await governor.send(
+            lambda: get_guard("inditex").call(
+                lambda **kwargs: get_client("inditex").get(
+                    VISUAL_SEARCH_BASE_URL,
+                    headers=headers,
+                    params=params,
+                    **kwargs
+                ),
+                endpoint="visual_search",
+                idempotent=True,
+                admit=governor.try_acquire,
+            )
         )
+        record_quota("inditex", response)
         response.raise_for_status()
-        print("Visual Search Response:", response.text)  # Debug line
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        results = response.json()
+        ingest_products(results)
+        return results
+    except httpx.HTTPError as e:
         print(f"Error en Visual Search: {e}")
-        if hasattr(e, 'response') and e.response:
+        if isinstance(e, httpx.HTTPStatusError):
             print(f"Response text: {e.response.text}")
         return None
+    except RateLimitExceeded as e:
+        print(f"Error en Visual Search: {e}")
+        return None
     except json.JSONDecodeError as e:
         print(f"Error al decodificar JSON. Respuesta: {response.text}")
         return None
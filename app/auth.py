@@ -5,18 +5,30 @@ from typing import Optional
 from fastapi.security import OAuth2PasswordBearer
 import os
 from fastapi import Depends, HTTPException, status
-from sqlalchemy.orm import Session
 
-from .database import get_db
+from sqlalchemy import select
+
+from .database import AsyncSessionLocal
 from .models.database import User
+from .services.cache import TTLCache
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Small LRU of user rows for tokens issued before the user_id claim existed.
+# AUTH_USER_CACHE_SIZE=0 disables it.
+user_cache = TTLCache(
+    "auth_users",
+    maxsize=int(os.getenv("AUTH_USER_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("AUTH_USER_CACHE_TTL", "300")),
+)
+
 # Add the OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# Same scheme for endpoints where authentication is optional
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -24,6 +36,24 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+class TokenUser:
+    """
+    Authenticated user as described by the access token claims.
+
+    Endpoints only need the identity of the caller, so it is built from the
+    JWT without querying the users table.
+    """
+    __slots__ = ("user_id", "email", "username")
+
+    def __init__(self, user_id: int, email: str, username: Optional[str] = None):
+        self.user_id = user_id
+        self.email = email
+        self.username = username
+
+def token_claims(user: User) -> dict:
+    """Claims embedded in the access token of ``user``."""
+    return {"sub": user.email, "user_id": user.user_id, "username": user.username}
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -34,10 +64,24 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+async def get_user_by_email(email: str) -> Optional[User]:
+    """Load a user row, going through ``user_cache``."""
+    user = user_cache.get(email)
+    if user is None:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(User).where(User.email == email))
+            user = result.scalars().first()
+        if user is not None:
+            user_cache.set(email, user)
+    return user
+
+def invalidate_user(email: str):
+    """Drop the cached row of ``email`` (call after updating the user)."""
+    user_cache.invalidate(email)
+
 async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-) -> User:
+    token: str = Depends(oauth2_scheme)
+) -> TokenUser:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -51,7 +95,27 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
 
-    user = db.query(User).filter(User.email == email).first()
+    user_id = payload.get("user_id")
+    if user_id is not None:
+        return TokenUser(user_id, email, payload.get("username"))
+
+    # Token issued before the user_id claim was added
+    user = await get_user_by_email(email)
     if user is None:
         raise credentials_exception
-    return user 
\ No newline at end of file
+    return TokenUser(user.user_id, user.email, user.username)
+
+async def get_optional_user(
+    token: Optional[str] = Depends(optional_oauth2_scheme)
+) -> Optional[TokenUser]:
+    """
+    Like ``get_current_user``, but None when no token is sent or it is not
+    valid (e.g. expired): the endpoint then serves the caller anonymously and
+    decides itself whether authentication is required.
+    """
+    if token is None:
+        return None
+    try:
+        return await get_current_user(token)
+    except HTTPException:
+        return None
@@ -1,33 +1,56 @@
 from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Request, Query, Header
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 import os
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
+import asyncio
 import base64
 import aiofiles
 from datetime import datetime
-import requests
+import httpx
 import json
 import logging
+import time
 
 # Use relative imports since we're inside the app package
-from .models.database import User, Base
-from .database import get_db, engine
-from .apis.product_search import search_products
-from .apis.visual_search import search_by_image
+from .models.database import User, Base, upgrade_schema
+from .database import get_async_db, engine, async_engine
+from .apis.product_search import (
+    search_products, search_products_multi, parse_brands, search_cache, search_cache_key, search_flights,
+    normalize_query,
+)
+from .apis.visual_search import search_by_image, search_by_image_url, url_search_cache, visual_flights
 from .apis.imgbb_api import upload_image_to_freeimage
+from .apis.inditex_api import get_token_manager
 from . import schemas
 from . import auth
 from .views import router as views_router
 from .apis.user_items import router as user_items_router
 from .apis.user_profile import router as user_profile_router
-from .services.screenshot import capture_screenshot
+from .services.screenshot import capture_screenshot_bytes, browser_pool
+from .services.preview_cache import preview_cache
+from .services.catalog import catalog_writer, search_local
+from .services.http_client import get_client, close_clients, UPSTREAMS
+from .services.visual_cache import visual_cache
+from .services.image_store import image_store, SignedStaticFiles
+from .services.ranking import ranker
+from .services.recommendation_cache import recommendation_cache
+from .services.prefetch import prefetcher
+from .services import rate_governor
+from .services import resilience
+from .services.resilience import get_guard, with_deadline, CircuitOpenError
+from .services import search_history
+from .services.search_history import log_search, search_history_writer
+from .services.cache_warmer import cache_warmer
+from .services.suggest import suggestion_indexer, MAX_SUGGESTIONS
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
 
 app = FastAPI()
 
@@ -40,47 +63,129 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def start_browser_pool():
+    try:
+        await browser_pool.start()
+    except Exception as e:
+        # Previews will retry the launch on demand
+        logger.error(f"Could not start browser pool: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_http_clients():
+    await close_clients()
+
+@app.on_event("startup")
+async def start_catalog_writer():
+    catalog_writer.start()
+
+@app.on_event("shutdown")
+async def stop_catalog_writer():
+    await catalog_writer.stop()
+
+@app.on_event("startup")
+async def start_search_history_writer():
+    search_history_writer.start()
+
+@app.on_event("shutdown")
+async def stop_search_history_writer():
+    await search_history_writer.stop()
+
+@app.on_event("shutdown")
+async def stop_prefetcher():
+    await prefetcher.stop()
+
+@app.on_event("startup")
+async def start_cache_warmer():
+    cache_warmer.start(warm_search, is_search_cached)
+
+@app.on_event("shutdown")
+async def stop_cache_warmer():
+    await cache_warmer.stop()
+
+@app.on_event("startup")
+async def start_suggestion_indexer():
+    suggestion_indexer.start()
+
+@app.on_event("shutdown")
+async def stop_suggestion_indexer():
+    await suggestion_indexer.stop()
+
+@app.on_event("shutdown")
+async def dispose_database_pool():
+    await async_engine.dispose()
+
+@app.on_event("shutdown")
+async def stop_browser_pool():
+    await browser_pool.stop()
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Create uploads directory if it doesn't exist
-UPLOAD_DIR = "static/uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-# Mount the uploads directory
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+# Mount the uploads directory (files are only served through signed URLs)
+app.mount("/uploads", SignedStaticFiles(store=image_store), name="uploads")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# End-to-end time budgets (seconds), split across the upstream hops of a request
+SEARCH_DEADLINE = float(os.getenv("SEARCH_DEADLINE", "15"))
+VISUAL_UPLOAD_DEADLINE = float(os.getenv("VISUAL_UPLOAD_DEADLINE", "30"))
+AGENT_DEADLINE = float(os.getenv("AGENT_DEADLINE", "120"))
+
+# Searches of one POST /search/products/batch request running at the same time
+SEARCH_BATCH_CONCURRENCY = int(os.getenv("SEARCH_BATCH_CONCURRENCY", "8"))
+# Most upstream searches one batch may fan out to (a brand=all entry counts once per brand)
+SEARCH_BATCH_MAX_FANOUT = int(os.getenv("SEARCH_BATCH_MAX_FANOUT", "100"))
+
+AGENT_URL = os.getenv("AGENT_URL", "http://agent:8001")
+# Longest silence allowed between two chunks of a streamed agent run
+AGENT_STREAM_IDLE_TIMEOUT = float(os.getenv("AGENT_STREAM_IDLE_TIMEOUT", "60"))
+
+# Minimum number of local catalog matches needed to skip the Inditex search
+LOCAL_SEARCH_MIN_RESULTS = int(os.getenv("LOCAL_SEARCH_MIN_RESULTS", "5"))
+
+RANK_QUERY = Query(None, regex="^profile$", description="'profile' re-ranks results with the caller's preferences (requires a token)")
+
+def require_ranking_user(rank: Optional[str], current_user: Optional[auth.TokenUser]):
+    """Reject ``rank=profile`` without an authenticated user."""
+    if rank == "profile" and current_user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="rank=profile requires authentication",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
 # Add near the top of the file, after imports
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # User management endpoints
 @app.post("/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if db_user:
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(User).where(User.email == user.email))
+    if result.scalars().first():
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = auth.get_password_hash(user.password)
+    hashed_password = await asyncio.to_thread(auth.get_password_hash, user.password)
     db_user = User(
         email=user.email,
         username=user.username,
         password_hash=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 @app.post("/token", response_model=schemas.Token)
-def login_for_access_token(
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user = db.query(User).filter(User.email == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.password_hash):
+    result = await db.execute(select(User).where(User.email == form_data.username))
+    user = result.scalars().first()
+    # bcrypt is deliberately slow: keep it off the event loop
+    if not user or not await asyncio.to_thread(auth.verify_password, form_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -88,17 +193,34 @@ def login_for_access_token(
         )
     
     access_token = auth.create_access_token(
-        data={"sub": user.email}
+        data=auth.token_claims(user)
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 # Product search endpoints
+async def warm_search(query: str, brand: Optional[str], per_page: int):
+    """Load page 1 of a popular search into the cache (used by the cache warmer)."""
+    brands = parse_brands(brand)
+    if brands:
+        merged = await search_products_multi(query, brands, page=1, per_page=per_page)
+        return merged["results"] or None
+    return await search_products(query, brand, page=1, per_page=per_page)
+
+def is_search_cached(query: str, brand: Optional[str], per_page: int) -> bool:
+    brands = parse_brands(brand) or [brand]
+    return all(search_cache.is_fresh(search_cache_key(query, b, 1, per_page)) for b in brands)
+
 @app.get("/search/products/")
+@with_deadline(SEARCH_DEADLINE)
+@log_search(search_history.TEXT, normalize=normalize_query)
 async def search_products_endpoint(
     query: str,
-    brand: str = None,
+    brand: str = Query(None, description="A brand, a comma-separated list of brands, or 'all'"),
     page: int = 1,
     per_page: int = 10,
+    source: str = Query("inditex", regex="^(inditex|local)$", description="'local' answers from the local catalog first"),
+    rank: Optional[str] = RANK_QUERY,
+    current_user: Optional[auth.TokenUser] = Depends(auth.get_optional_user),
     # token: str = Depends(oauth2_scheme),
     # authorization: str = Header(None)
 ):
@@ -111,28 +233,181 @@ async def search_products_endpoint(
     #         status_code=401,
     #         detail="Not authenticated"
     #     )
+    require_ranking_user(rank, current_user)
+    brands = parse_brands(brand)
+    if brands:
+        # Several brands (or brand=all): concurrent fan-out, merged with a per-brand status
+        if rank != "profile":
+            prefetch_key = ("products", search_cache_key(query, None, 0, 0)[0], tuple(brands), per_page)
+            prefetcher.claim(prefetch_key + (page,))
+            merged = await search_products_multi(query, brands, page=page, per_page=per_page)
+            if merged["results"]:
+                prefetcher.after(
+                    prefetch_key,
+                    page,
+                    lambda next_page: search_products_multi(query, brands, page=next_page, per_page=per_page),
+                    lambda next_page: all(
+                        search_cache.is_fresh(search_cache_key(query, b, next_page, per_page)) for b in brands
+                    ),
+                )
+            return merged
+
+        statuses = {}
 
-    results = search_products(
+        async def fetch_all_brands(upstream_page):
+            merged = await search_products_multi(query, brands, page=upstream_page, per_page=per_page)
+            for b, brand_status in merged["brands"].items():
+                # Report a brand as ok if any page of the window answered
+                if statuses.get(b) != "ok":
+                    statuses[b] = brand_status
+            return merged["results"]
+
+        results = await ranker.search(fetch_all_brands, current_user.user_id, page=page, per_page=per_page)
+        return {"results": results or [], "brands": statuses}
+
+    if rank == "profile":
+        # Re-rank fixed blocks of Inditex pages for this user
+        return await ranker.search(
+            lambda upstream_page: search_products(query, brand, page=upstream_page, per_page=per_page),
+            current_user.user_id,
+            page=page,
+            per_page=per_page,
+        )
+
+    if source == "local":
+        # Serve from the local catalog when it has enough matches, otherwise ask Inditex
+        try:
+            local_results = await search_local(query, brand, page=page, per_page=per_page)
+        except Exception as e:
+            logger.error(f"Local catalog search failed: {e}")
+            local_results = []
+        if len(local_results) >= min(per_page, LOCAL_SEARCH_MIN_RESULTS):
+            return local_results
+
+    cache_key = search_cache_key(query, brand, page, per_page)
+    prefetch_key = ("products",) + cache_key[:2] + (per_page,)
+    prefetcher.claim(prefetch_key + (page,))
+    results = await search_products(
         query,
         brand,
         page=page,
         per_page=per_page
     )
+    if results and len(results) >= per_page:
+        # A full page: the user is likely to ask for the next one
+        prefetcher.after(
+            prefetch_key,
+            page,
+            lambda next_page: search_products(query, brand, page=next_page, per_page=per_page),
+            lambda next_page: search_cache.is_fresh(search_cache_key(query, brand, next_page, per_page)),
+        )
     return results
 
+@app.get("/search/suggest")
+async def search_suggest_endpoint(
+    prefix: str = Query(..., min_length=1, max_length=100, description="What the user has typed so far"),
+    limit: int = Query(8, ge=1, le=MAX_SUGGESTIONS),
+):
+    """
+    Typeahead: the most popular known queries and product names with a word
+    starting with ``prefix``. Served from memory, no upstream call.
+    """
+    return {"prefix": prefix, "suggestions": suggestion_indexer.lookup(prefix, limit)}
+
+async def run_batch_search(search: schemas.ProductSearchQuery, semaphore: asyncio.Semaphore) -> dict:
+    """One search of a batch; failures are reported in the entry instead of raised."""
+    async with semaphore:
+        started = time.monotonic()
+        with search_history.tracking(normalize_query(search.query)) as record:
+            entry = await _run_batch_search(search)
+        search_history.record_search(
+            search_history.TEXT,
+            record.query,
+            brand=search.brand,
+            result_count=search_history.count_results(entry),
+            latency_ms=int((time.monotonic() - started) * 1000),
+            cache_hit=record.cache_hit,
+        )
+        return entry
+
+async def _run_batch_search(search: schemas.ProductSearchQuery) -> dict:
+    try:
+        brands = parse_brands(search.brand)
+        if brands:
+            merged = await search_products_multi(search.query, brands, page=search.page, per_page=search.per_page)
+            return {"status": "ok", **merged}
+        results = await search_products(search.query, search.brand, page=search.page, per_page=search.per_page)
+    except Exception as e:
+        logger.error(f"Batch search failed for {search.query!r}: {e}")
+        return {"status": "error", "detail": str(e)}
+    if results is None:
+        return {"status": "error", "detail": "Failed to perform product search"}
+    return {"status": "ok", "results": results}
+
+@app.post("/search/products/batch")
+@with_deadline(SEARCH_DEADLINE)
+async def search_products_batch_endpoint(batch: schemas.ProductSearchBatch):
+    """
+    Run many product searches in one round trip.
+
+    The searches run concurrently (at most SEARCH_BATCH_CONCURRENCY at a
+    time) through the same cache, request coalescing and rate governor as
+    ``/search/products/``. The response maps each search's ``key`` (or its
+    index in the batch) to ``{"status": "ok", "results": [...]}`` or
+    ``{"status": "error", "detail": ...}``; one failed search does not fail
+    the batch.
+
+    A batch may fan out to at most SEARCH_BATCH_MAX_FANOUT upstream searches
+    (one per brand of each entry), and its searches queue behind interactive
+    ones in the rate governor so a large batch cannot starve live traffic.
+    """
+    fanout = sum(len(parse_brands(search.brand) or [search.brand]) for search in batch.searches)
+    if fanout > SEARCH_BATCH_MAX_FANOUT:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"The batch needs {fanout} upstream searches, at most {SEARCH_BATCH_MAX_FANOUT} are allowed",
+        )
+    semaphore = asyncio.Semaphore(SEARCH_BATCH_CONCURRENCY)
+    keys = [search.key if search.key is not None else str(i) for i, search in enumerate(batch.searches)]
+    with rate_governor.request_priority(rate_governor.PREFETCH):
+        entries = await asyncio.gather(*(run_batch_search(search, semaphore) for search in batch.searches))
+    return {"results": dict(zip(keys, entries))}
+
 @app.get("/search/visual/")
+@with_deadline(SEARCH_DEADLINE)
+@log_search(search_history.VISUAL, query_param="image_url", normalize=str.strip)
 async def visual_search_url_endpoint(
     image_url: str = Query(..., description="URL of the image to search"),
     page: int = 1,
     per_page: int = 10,
-    token: str = Depends(oauth2_scheme)
+    rank: Optional[str] = RANK_QUERY,
+    token: str = Depends(oauth2_scheme),
+    current_user: Optional[auth.TokenUser] = Depends(auth.get_optional_user)
 ):
+    require_ranking_user(rank, current_user)
     try:
-        results = search_by_image(
-            image_url,
-            page=page,
-            per_page=per_page
-        )
+        if rank == "profile":
+            results = await ranker.search(
+                lambda upstream_page: search_by_image(image_url, page=upstream_page, per_page=per_page),
+                current_user.user_id,
+                page=page,
+                per_page=per_page,
+            )
+        else:
+            prefetch_key = ("visual_url", image_url, per_page)
+            prefetcher.claim(prefetch_key + (page,))
+            results = await search_by_image_url(
+                image_url,
+                page=page,
+                per_page=per_page
+            )
+            if results and len(results) >= per_page:
+                prefetcher.after(
+                    prefetch_key,
+                    page,
+                    lambda next_page: search_by_image_url(image_url, page=next_page, per_page=per_page),
+                    lambda next_page: url_search_cache.is_fresh((image_url.strip(), next_page, per_page)),
+                )
         if results is None:
             raise HTTPException(
                 status_code=500,
@@ -149,12 +424,17 @@ async def visual_search_url_endpoint(
         )
 
 @app.post("/search/visual/")
+@with_deadline(VISUAL_UPLOAD_DEADLINE)
+@log_search(search_history.VISUAL)
 async def visual_search_file_endpoint(
     file: UploadFile = File(...),
     page: int = 1,
     per_page: int = 10,
-    token: str = Depends(oauth2_scheme)
+    rank: Optional[str] = RANK_QUERY,
+    token: str = Depends(oauth2_scheme),
+    current_user: Optional[auth.TokenUser] = Depends(auth.get_optional_user)
 ):
+    require_ranking_user(rank, current_user)
     try:
         # Log the incoming request details
         print(f"Received file upload: {file.filename}, type: {file.content_type}, size: {file.spool_max_size} bytes")
@@ -162,23 +442,54 @@ async def visual_search_file_endpoint(
         # Read the file content
         content = await file.read()
         print(f"File content read successfully, size: {len(content)} bytes")
-        
-        # Upload to ImgBB
-        image_url = upload_image_to_freeimage(content, name=file.filename)
-        print(f"Image uploaded to ImgBB, URL: {image_url}")
-        
-        if not image_url:
-            raise HTTPException(
-                status_code=500,
-                detail="Failed to upload image"
+
+        # Same (or visually identical) image searched recently: skip upload and search
+        fingerprint = await visual_cache.fingerprint(content)
+        search_history.set_search_query(f"image:{fingerprint.sha256}")
+        upload = None
+
+        async def get_image_url():
+            # Upload at most once, and only if some page is not cached
+            nonlocal upload
+            if upload is None:
+                upload = asyncio.ensure_future(upload_search_image(content, file, fingerprint))
+            return await asyncio.shield(upload)
+
+        async def search_page(upstream_page):
+            # Pass the image URL to the search function
+            results = await search_by_image(
+                await get_image_url(),
+                page=upstream_page,
+                per_page=per_page
             )
-        
-        # Pass the ImgBB URL to the search function
-        results = search_by_image(
-            image_url,
-            page=page,
-            per_page=per_page
-        )
+            if results is not None:
+                visual_cache.set(fingerprint, upstream_page, per_page, results)
+            return results
+
+        async def fetch_page(upstream_page):
+            cached_results = visual_cache.get(fingerprint, upstream_page, per_page)
+            search_history.note_cache_lookup(cached_results is not None)
+            if cached_results is not None:
+                return cached_results
+            # The same image uploaded by several clients at once: one upload and search
+            return await visual_flights.do(
+                ("upload", fingerprint.sha256, upstream_page, per_page),
+                lambda: search_page(upstream_page)
+            )
+
+        if rank == "profile":
+            results = await ranker.search(fetch_page, current_user.user_id, page=page, per_page=per_page)
+        else:
+            prefetch_key = ("visual_image", fingerprint.sha256, per_page)
+            prefetcher.claim(prefetch_key + (page,))
+            results = await fetch_page(page)
+            if results and len(results) >= per_page:
+                prefetcher.after(
+                    prefetch_key,
+                    page,
+                    fetch_page,
+                    lambda next_page: visual_cache.is_fresh(fingerprint, next_page, per_page),
+                )
         print(f"Search results: {results}")
         
         if results is None:
@@ -186,7 +497,7 @@ async def visual_search_file_endpoint(
                 status_code=500,
                 detail="Failed to perform visual search"
             )
-            
+
         return results
         
     except Exception as e:
@@ -196,6 +507,24 @@ async def visual_search_file_endpoint(
             detail=str(e)
         )
 
+async def upload_search_image(content: bytes, file: UploadFile, fingerprint) -> str:
+    """Make an uploaded image reachable by the Inditex visual search."""
+    if image_store.public:
+        # Store the image ourselves and give Inditex a short-lived signed URL
+        stored_name = await image_store.save(content, file.content_type, digest=fingerprint.sha256)
+        image_url = image_store.signed_url(stored_name)
+    else:
+        # No public URL configured for this instance: fall back to freeimage.host
+        image_url = await upload_image_to_freeimage(content, name=file.filename)
+        print(f"Image uploaded to ImgBB, URL: {image_url}")
+
+    if not image_url:
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to upload image"
+        )
+    return image_url
+
 # Add this line after creating the FastAPI app but before other routes
 app.include_router(views_router)
 
@@ -205,23 +534,34 @@ app.include_router(user_profile_router, prefix="/api/user", tags=["user profile"
 
 # Update the clothing recommendations endpoint
 @app.get("/agent/clothing-recommendations/")
+@with_deadline(AGENT_DEADLINE)
 async def clothing_recommendations_endpoint(
     query: str,
-    token: str = Depends(oauth2_scheme)
+    current_user: auth.TokenUser = Depends(auth.get_current_user)
 ):
     """
     Get clothing recommendations based on natural language query.
     """
+    # Near-identical prompts from users with the same preferences share an answer
+    cache_key = await recommendation_cache.key(current_user.user_id, query)
+    cached = recommendation_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Serving cached recommendation for: {query}")
+        return cached
+
     try:
         logger.info(f"Forwarding recommendation request to agent service: {query}")
-        response = requests.get(
-            f"http://agent:8001/recommendations",
-            params={"query": query},
-            timeout=300  # 5 minute timeout
+        response = await get_guard("agent").call(
+            lambda **kwargs: get_client("agent").get(
+                f"{AGENT_URL}/recommendations",
+                params={"query": query},
+                **kwargs
+            ),
+            endpoint="recommendations",
         )
         
         logger.info(f"Agent service responded with status code: {response.status_code}")
-        if not response.ok:
+        if not response.is_success:
             logger.error(f"Agent service error response: {response.text}")
             raise HTTPException(
                 status_code=response.status_code,
@@ -230,9 +570,16 @@ async def clothing_recommendations_endpoint(
         
         data = response.json()
         logger.info("Successfully parsed agent response")
+        recommendation_cache.set(cache_key, data)
         return data
             
-    except requests.Timeout:
+    except CircuitOpenError:
+        logger.error("Agent service circuit is open, failing fast")
+        raise HTTPException(
+            status_code=503,
+            detail="Agent service is unavailable"
+        )
+    except httpx.TimeoutException:
         logger.error("Request to agent service timed out")
         raise HTTPException(
             status_code=504,
@@ -245,6 +592,175 @@ async def clothing_recommendations_endpoint(
             detail="An unexpected error occurred"
         )
 
+def sse_event(event: str, data) -> str:
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def agent_event_outcome(event, data_lines, answer, failed):
+    """Fold one relayed SSE event into the run's ``(answer, failed)`` state."""
+    if event == "error":
+        return answer, True
+    if event == "message" and data_lines:
+        try:
+            return json.loads("\n".join(data_lines)), failed
+        except ValueError:
+            pass
+    return answer, failed
+
+async def relay_agent_stream(request: Request, query: str, cache_key=None):
+    """
+    Relay a streamed agent run as Server-Sent Events.
+
+    The agent's ``/recommendations/stream`` endpoint emits SSE (``token``,
+    ``tool``, ``message`` and ``error`` events), which are forwarded line by
+    line. Agents without that endpoint (404/405/501) are called on the
+    blocking ``/recommendations`` endpoint and their answer is sent as a
+    single ``message`` event. ``start`` and ``done`` events are added here.
+
+    When the browser disconnects the generator is closed, which closes the
+    upstream connection and so cancels the agent run. The last ``message``
+    answer is stored in ``recommendation_cache`` under ``cache_key`` once the
+    stream has ended cleanly without an ``error`` event.
+    """
+    yield sse_event("start", {"query": query})
+    cached = recommendation_cache.get(cache_key)
+    if cached is not None:
+        yield sse_event("message", cached)
+        yield sse_event("done", {"cached": True})
+        return
+    try:
+        async with get_guard("agent").stream(
+            get_client("agent"),
+            "GET",
+            f"{AGENT_URL}/recommendations/stream",
+            params={"query": query},
+            headers={"Accept": "text/event-stream"},
+            timeout=httpx.Timeout(AGENT_STREAM_IDLE_TIMEOUT, connect=UPSTREAMS["agent"]["connect_timeout"]),
+        ) as response:
+            streaming = response.status_code not in (404, 405, 501)
+            if streaming:
+                if not response.is_success:
+                    await response.aread()
+                    logger.error(f"Agent service error response: {response.text}")
+                    yield sse_event("error", {"status": response.status_code, "message": f"Agent service error: {response.text}"})
+                    return
+                event, data_lines = None, []
+                answer, agent_failed = None, False
+                async for line in response.aiter_lines():
+                    if await request.is_disconnected():
+                        logger.info("Client disconnected, cancelling agent run")
+                        return
+                    # aiter_lines keeps the line ending; SSE framing needs exactly one
+                    line = line.rstrip("\r\n")
+                    if line.startswith("event:"):
+                        event = line[6:].strip()
+                    elif line.startswith("data:"):
+                        data_lines.append(line[5:])
+                    elif not line:
+                        # End of an event: remember the final answer for the cache
+                        answer, agent_failed = agent_event_outcome(event, data_lines, answer, agent_failed)
+                        event, data_lines = None, []
+                    yield line + "\n"
+                answer, agent_failed = agent_event_outcome(event, data_lines, answer, agent_failed)
+                # Only a run that finished without an error event is cached
+                if answer is not None and not agent_failed:
+                    recommendation_cache.set(cache_key, answer)
+
+        if not streaming:
+            # Agent without a streaming endpoint: one event with the whole answer
+            response = await get_guard("agent").call(
+                lambda **kwargs: get_client("agent").get(
+                    f"{AGENT_URL}/recommendations",
+                    params={"query": query},
+                    **kwargs
+                ),
+                endpoint="recommendations",
+            )
+            if not response.is_success:
+                logger.error(f"Agent service error response: {response.text}")
+                yield sse_event("error", {"status": response.status_code, "message": f"Agent service error: {response.text}"})
+                return
+            data = response.json()
+            recommendation_cache.set(cache_key, data)
+            yield sse_event("message", data)
+
+        yield sse_event("done", {})
+
+    except CircuitOpenError:
+        logger.error("Agent service circuit is open, failing fast")
+        yield sse_event("error", {"status": 503, "message": "Agent service is unavailable"})
+    except httpx.TimeoutException:
+        logger.error("Streamed request to agent service timed out")
+        yield sse_event("error", {"status": 504, "message": "Request to agent service timed out"})
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+        yield sse_event("error", {"status": 500, "message": "An unexpected error occurred"})
+
+@app.get("/agent/clothing-recommendations/stream")
+async def clothing_recommendations_stream_endpoint(
+    request: Request,
+    query: str,
+    current_user: auth.TokenUser = Depends(auth.get_current_user)
+):
+    """
+    Stream clothing recommendations (tokens and intermediate tool results)
+    as Server-Sent Events.
+    """
+    logger.info(f"Streaming recommendation request from agent service: {query}")
+    cache_key = await recommendation_cache.key(current_user.user_id, query)
+    return StreamingResponse(
+        relay_agent_stream(request, query, cache_key),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Do not let a reverse proxy buffer the stream
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+@app.get("/health/live")
+async def liveness_endpoint():
+    """The process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def readiness_endpoint(response: Response):
+    """
+    Whether the instance should receive traffic: 503 until the search cache
+    has been warmed (or the warm-up timeout has passed).
+    """
+    if not cache_warmer.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "warming"}
+    return {"status": "ready"}
+
+@app.get("/stats")
+async def stats_endpoint():
+    """
+    Internal counters for the upstream integrations.
+    """
+    return {
+        "inditex_token": get_token_manager().stats(),
+        "product_search_cache": search_cache.stats(),
+        "visual_search_cache": visual_cache.stats(),
+        "image_store": image_store.stats(),
+        "browser_pool": browser_pool.stats(),
+        "preview_cache": preview_cache.stats(),
+        "auth_user_cache": auth.user_cache.stats(),
+        "catalog_writer": catalog_writer.stats(),
+        "search_history_writer": search_history_writer.stats(),
+        "cache_warmer": cache_warmer.stats(),
+        "suggestions": suggestion_indexer.stats(),
+        "ranking": ranker.stats(),
+        "visual_url_search_cache": url_search_cache.stats(),
+        "prefetch": prefetcher.stats(),
+        "inditex_rate_governor": rate_governor.stats(),
+        "upstreams": resilience.stats(),
+        "recommendation_cache": recommendation_cache.stats(),
+        "product_search_flights": search_flights.stats(),
+        "visual_search_flights": visual_flights.stats(),
+    }
+
 # Remove or comment out the existing root route
 # @app.get("/")
 # async def root():
@@ -254,12 +770,28 @@ async def clothing_recommendations_endpoint(
 async def get_preview(
     item_id: str,
     url: str,
+    request: Request,
+    format: str = Query("jpeg", regex="^(jpeg|json)$", description="'json' returns a base64 data URL"),
     token: str = Depends(oauth2_scheme)
 ):
+    cache_headers = {"Cache-Control": f"private, max-age={preview_cache.ttl}"}
+    if format == "jpeg":
+        etag = preview_cache.not_modified(item_id, url, request.headers.get("if-none-match"))
+        if etag:
+            return Response(status_code=304, headers={"ETag": etag, **cache_headers})
+
     try:
-        screenshot_base64 = await capture_screenshot(url)
-        if screenshot_base64:
-            return {"image": f"data:image/jpeg;base64,{screenshot_base64}"}
-        raise HTTPException(status_code=500, detail="Failed to generate preview")
+        preview = await preview_cache.get_or_render(item_id, url, capture_screenshot_bytes)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+    if preview is None:
+        raise HTTPException(status_code=500, detail="Failed to generate preview")
+
+    if format == "json":
+        screenshot_base64 = base64.b64encode(preview.data).decode("utf-8")
+        return {"image": f"data:image/jpeg;base64,{screenshot_base64}"}
+    return Response(
+        content=preview.data,
+        media_type="image/jpeg",
+        headers={"ETag": preview.etag, **cache_headers}
+    )
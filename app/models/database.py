@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Date, ARRAY, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Date, ARRAY, JSON, Numeric, Text, Computed, Index, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 
@@ -21,4 +22,68 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     last_login = Column(DateTime, nullable=True)
-    is_active = Column(Boolean, default=True) 
\ No newline at end of file
+    is_active = Column(Boolean, default=True)
+
+
+class CatalogProduct(Base):
+    """
+    Local product catalog (written by ``app/services/catalog.py``).
+
+    Mirrors the ``products`` table of ``db/init/init_database.sql`` so that
+    ``create_all`` also creates it on databases initialized before it existed.
+    """
+    __tablename__ = "products"
+    __table_args__ = (
+        Index("idx_products_search", "search_vector", postgresql_using="gin"),
+        Index("idx_products_brand", "brand"),
+        Index("idx_products_first_seen", "first_seen"),
+    )
+
+    product_id = Column(String(64), primary_key=True)
+    name = Column(String(255), nullable=False)
+    brand = Column(String(50), nullable=True)
+    price_currency = Column(String(3), nullable=True)
+    price_current = Column(Numeric(10, 2), nullable=True)
+    price_original = Column(Numeric(10, 2), nullable=True)
+    link = Column(Text, nullable=True)
+    search_vector = Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(brand, '')), 'B')",
+        persisted=True,
+    ))
+    first_seen = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
+    last_seen = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"))
+
+
+# Idempotent upgrades of tables created by older versions of
+# db/init/init_database.sql (which only runs on an empty volume).
+SCHEMA_UPGRADES = [
+    """
+    CREATE TABLE IF NOT EXISTS search_history (
+        search_id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
+        search_query VARCHAR(255) NOT NULL,
+        search_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # Columns written by the search history writer; anonymous searches have no user
+    """
+    ALTER TABLE search_history
+        ADD COLUMN IF NOT EXISTS brand VARCHAR(100),
+        ADD COLUMN IF NOT EXISTS search_type VARCHAR(10) NOT NULL DEFAULT 'text',
+        ADD COLUMN IF NOT EXISTS result_count INTEGER,
+        ADD COLUMN IF NOT EXISTS latency_ms INTEGER,
+        ADD COLUMN IF NOT EXISTS cache_hit BOOLEAN,
+        ALTER COLUMN user_id DROP NOT NULL
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_search_history_user ON search_history(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_search_history_date ON search_history(search_date)",
+]
+
+
+def upgrade_schema(engine):
+    """Apply ``SCHEMA_UPGRADES`` (run at startup, after ``create_all``)."""
+    with engine.begin() as connection:
+        for statement in SCHEMA_UPGRADES:
+            connection.execute(text(statement))
+
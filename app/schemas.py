@@ -1,4 +1,5 @@
 from pydantic import BaseModel, validator
+import os
 from typing import List, Optional, Union
 from datetime import date, datetime
 
@@ -52,4 +53,28 @@ class UserProfile(UserProfileUpdate):
     created_at: datetime
     
     class Config:
-        orm_mode = True 
\ No newline at end of file
+        orm_mode = True
+
+# Most searches accepted by POST /search/products/batch
+MAX_BATCH_SEARCHES = int(os.getenv("SEARCH_BATCH_MAX", "50"))
+
+class ProductSearchQuery(BaseModel):
+    # Key of this search in the response; defaults to its position in the batch
+    key: Optional[str] = None
+    query: str
+    brand: Optional[str] = None
+    page: int = 1
+    per_page: int = 10
+
+class ProductSearchBatch(BaseModel):
+    searches: List[ProductSearchQuery]
+
+    @validator("searches")
+    def check_searches(cls, searches):
+        if not 1 <= len(searches) <= MAX_BATCH_SEARCHES:
+            raise ValueError(f"between 1 and {MAX_BATCH_SEARCHES} searches are required")
+        keys = [search.key if search.key is not None else str(i) for i, search in enumerate(searches)]
+        if len(set(keys)) != len(keys):
+            raise ValueError("search keys must be unique")
+        return searches
+
@@ -0,0 +1,184 @@
+"""
+In-process result caches.
+
+``TTLCache`` is a bounded LRU cache whose entries expire after a TTL. Expired
+entries are kept for an extra ``stale_ttl`` window: a lookup in that window
+returns the stale value immediately and refreshes it in the background
+(stale-while-revalidate), so hot keys are never served cold.
+
+The cache is meant to be used from the event loop; it is not thread-safe.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+
+from .rate_governor import request_priority, BACKGROUND
+from .resilience import deadline
+
+FRESH = "fresh"
+STALE = "stale"
+MISS = "miss"
+
+
+class _Entry:
+    __slots__ = ("value", "fresh_until", "stale_until")
+
+    def __init__(self, value, fresh_until, stale_until):
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class TTLCache:
+    """
+    LRU cache with per-entry TTL and stale-while-revalidate.
+
+    Args:
+        name: Name used in the metrics.
+        maxsize: Maximum number of entries; the least recently used entry is
+            evicted when the cache is full.
+        ttl: Seconds an entry is served as fresh.
+        stale_ttl: Extra seconds an expired entry may still be served while
+            it is refreshed in the background. ``0`` disables stale serving.
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=300, stale_ttl=0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()
+        self._refreshing = {}
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.lookup(key, record=False)[1] != MISS
+
+    def lookup(self, key, record=True):
+        """
+        Look up ``key`` without loading it.
+
+        Returns:
+            tuple: ``(value, state)`` where ``state`` is ``FRESH``, ``STALE``
+            or ``MISS`` (``value`` is None on a miss).
+        """
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None and now >= entry.stale_until:
+            del self._entries[key]
+            entry = None
+
+        if entry is None:
+            if record:
+                self.misses += 1
+            return None, MISS
+
+        self._entries.move_to_end(key)
+        if now < entry.fresh_until:
+            if record:
+                self.hits += 1
+            return entry.value, FRESH
+        if record:
+            self.stale_hits += 1
+        return entry.value, STALE
+
+    def is_fresh(self, key):
+        """Whether ``key`` is cached and fresh (not counted in the metrics)."""
+        return self.lookup(key, record=False)[1] == FRESH
+
+    def get(self, key, default=None):
+        """Return the cached value for ``key`` (fresh or stale), or ``default``."""
+        value, state = self.lookup(key)
+        return default if state == MISS else value
+
+    def set(self, key, value, ttl=None):
+        """Store ``value`` under ``key``, evicting the LRU entry if needed."""
+        now = time.monotonic()
+        fresh_until = now + (self.ttl if ttl is None else ttl)
+        self._entries[key] = _Entry(value, fresh_until, fresh_until + self.stale_ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def keys(self):
+        """Snapshot of the cached keys, least recently used first."""
+        return list(self._entries)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def get_or_load(self, key, loader):
+        """
+        Return the value for ``key``, calling ``await loader()`` on a miss.
+
+        Stale entries are returned immediately and refreshed in the background.
+        ``None`` results from ``loader`` are treated as errors and not cached.
+        """
+        value, state = self.lookup(key)
+        if state == FRESH:
+            return value
+        if state == STALE:
+            self.refresh(key, loader)
+            return value
+
+        value = await loader()
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def refresh(self, key, loader):
+        """
+        Reload ``key`` in the background unless a refresh is already running.
+
+        Returns:
+            asyncio.Task: The refresh task.
+        """
+        task = self._refreshing.get(key)
+        if task is None:
+            # Background refreshes queue behind user requests in the rate governor
+            # and are not bound by the deadline of the request that found the stale entry
+            with request_priority(BACKGROUND), deadline(None, inherit=False):
+                task = asyncio.ensure_future(self._refresh(key, loader))
+            self._refreshing[key] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+        return task
+
+    async def _refresh(self, key, loader):
+        try:
+            value = await loader()
+        except Exception as e:
+            print(f"Error refreshing {self.name} cache entry {key!r}: {e}")
+            value = None
+        if value is None:
+            self.refresh_errors += 1
+            return None
+        self.refreshes += 1
+        self.set(key, value)
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+        }
@@ -0,0 +1,188 @@
+"""
+Warms the product search cache with the most popular recent searches.
+
+After a deploy (or a ``--reload``) the result caches are empty and the first
+minutes of traffic would all go to Inditex. On startup, and then every
+``WARM_INTERVAL`` seconds, the warmer reads the ``WARM_TOP_N`` most frequent
+normalized text queries per brand of the last ``WARM_WINDOW_HOURS`` hours from
+``search_history`` and loads their first page into the cache.
+
+Warming must never compete with live traffic:
+
+* searches are started at most ``WARM_RATE`` per second, one at a time,
+* they run at background priority, so the rate governor serves interactive
+  and prefetch calls first,
+* nothing is warmed while the upstream reports less than ``WARM_MIN_QUOTA``
+  remaining requests, and searches that are already cached are skipped.
+
+The instance reports itself ready (``/health/ready``) once the first pass is
+done, or after ``WARM_READY_TIMEOUT`` seconds, whichever comes first.
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from ..database import AsyncSessionLocal
+from .http_client import quota_remaining
+from .rate_governor import request_priority, BACKGROUND
+from .resilience import deadline
+
+WARM_TOP_N = int(os.getenv("WARM_TOP_N", "20"))
+WARM_WINDOW_HOURS = float(os.getenv("WARM_WINDOW_HOURS", "24"))
+WARM_RATE = float(os.getenv("WARM_RATE", "1"))
+WARM_INTERVAL = float(os.getenv("WARM_INTERVAL", "900"))
+WARM_MIN_QUOTA = int(os.getenv("WARM_MIN_QUOTA", "100"))
+WARM_READY_TIMEOUT = float(os.getenv("WARM_READY_TIMEOUT", "60"))
+WARM_DEADLINE = float(os.getenv("WARM_DEADLINE", "30"))
+# Page size the searches are warmed with (the one the web UI asks for)
+WARM_PER_PAGE = int(os.getenv("WARM_PER_PAGE", "10"))
+
+POPULAR_QUERIES = text("""
+    SELECT search_query, brand, searches
+    FROM (
+        SELECT search_query, COALESCE(brand, '') AS brand, COUNT(*) AS searches,
+               ROW_NUMBER() OVER (PARTITION BY COALESCE(brand, '') ORDER BY COUNT(*) DESC) AS brand_rank
+        FROM search_history
+        WHERE search_type = 'text' AND search_date >= :since AND result_count > 0
+        GROUP BY search_query, COALESCE(brand, '')
+    ) ranked
+    WHERE brand_rank <= :top_n
+    ORDER BY searches DESC
+""")
+
+
+class CacheWarmer:
+    """
+    Periodically loads popular searches into the result cache.
+
+    Args:
+        top_n: Queries warmed per brand (0 disables warming).
+        window_hours: How far back ``search_history`` is read.
+        rate: Maximum searches started per second (0: no pause between them).
+        interval: Seconds between two warming passes.
+        min_quota: Minimum remaining upstream quota needed to warm.
+        ready_timeout: Seconds after which the instance is ready even if the
+            first pass has not finished.
+        upstream: Upstream whose quota is checked.
+    """
+
+    def __init__(self, top_n=WARM_TOP_N, window_hours=WARM_WINDOW_HOURS, rate=WARM_RATE,
+                 interval=WARM_INTERVAL, min_quota=WARM_MIN_QUOTA, ready_timeout=WARM_READY_TIMEOUT,
+                 upstream="inditex"):
+        self.top_n = top_n
+        self.window_hours = window_hours
+        self.rate = rate
+        self.interval = interval
+        self.min_quota = min_quota
+        self.ready_timeout = ready_timeout
+        self.upstream = upstream
+        self._task = None
+        self._started_at = None
+        self._warmed_once = False
+
+        self.passes = 0
+        self.warmed = 0
+        self.failed = 0
+        self.skipped_cached = 0
+        self.skipped_quota = 0
+        self.last_pass_duration = 0.0
+        self.last_pass_queries = 0
+
+    @property
+    def ready(self):
+        """Whether the instance may receive traffic."""
+        if self._warmed_once or self.top_n <= 0:
+            return True
+        return self._started_at is not None and time.monotonic() - self._started_at >= self.ready_timeout
+
+    def start(self, load, is_cached=None):
+        """
+        Start warming in the background.
+
+        Args:
+            load: ``async load(query, brand, per_page)`` searching page 1 of
+                ``query`` (``brand`` may be None) through the result cache.
+            is_cached: Optional ``is_cached(query, brand, per_page)`` returning
+                True when that page is already cached and fresh.
+        """
+        if self.top_n <= 0:
+            return
+        if self._task is None or self._task.done():
+            self._started_at = time.monotonic()
+            with request_priority(BACKGROUND):
+                self._task = asyncio.ensure_future(self._run(load, is_cached))
+
+    async def popular_queries(self):
+        """``(query, brand)`` pairs to warm, most searched first."""
+        since = datetime.utcnow() - timedelta(hours=self.window_hours)
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(POPULAR_QUERIES, {"since": since, "top_n": self.top_n})).mappings().all()
+        return [(row["search_query"], row["brand"] or None) for row in rows]
+
+    async def _run(self, load, is_cached):
+        while True:
+            try:
+                await self.warm(load, is_cached)
+            except Exception as e:
+                print(f"Cache warming failed: {e}")
+            finally:
+                self._warmed_once = True
+            await asyncio.sleep(self.interval)
+
+    async def warm(self, load, is_cached=None):
+        """Run one warming pass."""
+        started = time.monotonic()
+        queries = await self.popular_queries()
+        for query, brand in queries:
+            if is_cached is not None and is_cached(query, brand, WARM_PER_PAGE):
+                self.skipped_cached += 1
+                continue
+            remaining = quota_remaining(self.upstream)
+            if remaining is not None and remaining < self.min_quota:
+                # Leave the rest of the quota to live traffic until the next pass
+                self.skipped_quota += 1
+                break
+            try:
+                # Own deadline: no request is waiting for this search
+                with deadline(WARM_DEADLINE, inherit=False):
+                    results = await load(query, brand, WARM_PER_PAGE)
+            except Exception as e:
+                print(f"Warming {query!r} failed: {e}")
+                results = None
+            if results is None:
+                self.failed += 1
+            else:
+                self.warmed += 1
+            if self.rate > 0:
+                await asyncio.sleep(1 / self.rate)
+        self.passes += 1
+        self.last_pass_queries = len(queries)
+        self.last_pass_duration = time.monotonic() - started
+
+    async def stop(self):
+        """Stop warming (called on shutdown)."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "passes": self.passes,
+            "warmed": self.warmed,
+            "failed": self.failed,
+            "skipped_cached": self.skipped_cached,
+            "skipped_quota": self.skipped_quota,
+            "last_pass_queries": self.last_pass_queries,
+            "last_pass_duration": round(self.last_pass_duration, 4),
+        }
+
+
+cache_warmer = CacheWarmer()
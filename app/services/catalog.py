@@ -0,0 +1,130 @@
+"""
+Local product catalog built from the products returned by Inditex.
+
+Every product seen in a text or visual search is parsed into a columnar
+``ProductBatch`` and upserted into the ``products`` table by a
+write-behind ``BatchWriter``, off the request path. ``search_local`` answers
+text searches from the table's full-text index.
+"""
+import os
+
+import numpy as np
+from sqlalchemy import text
+
+from models.product import ProductBatch
+
+from ..database import AsyncSessionLocal
+from .write_behind import BatchWriter
+
+UPSERT_PRODUCT = text("""
+    INSERT INTO products (product_id, name, brand, price_currency, price_current, price_original, link)
+    VALUES (:product_id, :name, :brand, :price_currency, :price_current, :price_original, :link)
+    ON CONFLICT (product_id) DO UPDATE SET
+        name = EXCLUDED.name,
+        brand = COALESCE(EXCLUDED.brand, products.brand),
+        price_currency = EXCLUDED.price_currency,
+        price_current = EXCLUDED.price_current,
+        price_original = EXCLUDED.price_original,
+        link = EXCLUDED.link,
+        last_seen = CURRENT_TIMESTAMP
+""")
+
+
+def _product_rows(results, brand=None):
+    """Normalize an Inditex result list into ``products`` rows."""
+    batch = ProductBatch.from_inditex(results, brand)
+    valid = np.fromiter(
+        (product_id is not None and bool(name) for product_id, name in zip(batch.ids, batch.names)),
+        dtype=bool,
+        count=len(batch),
+    )
+    batch = batch.filter(valid).dedupe()
+    return [
+        {
+            "product_id": str(product_id),
+            "name": str(name)[:255],
+            "brand": (product_brand or "").lower() or None,
+            "price_currency": currency,
+            # NaN != NaN: missing price
+            "price_current": current if current == current else None,
+            "price_original": original if original == original else None,
+            "link": link,
+        }
+        for product_id, name, product_brand, currency, link, current, original in zip(
+            batch.ids.tolist(), batch.names.tolist(), batch.brands.tolist(), batch.currencies.tolist(),
+            batch.links.tolist(), batch.price_current.tolist(), batch.price_original.tolist(),
+        )
+    ]
+
+
+async def _upsert_products(rows):
+    # The same product often appears in several searches of one batch
+    unique = list({row["product_id"]: row for row in rows}.values())
+    async with AsyncSessionLocal() as db:
+        await db.execute(UPSERT_PRODUCT, unique)
+        await db.commit()
+
+
+catalog_writer = BatchWriter(
+    "catalog",
+    _upsert_products,
+    max_batch=int(os.getenv("CATALOG_BATCH_SIZE", "500")),
+    interval=float(os.getenv("CATALOG_FLUSH_INTERVAL", "1.0")),
+    max_queue=int(os.getenv("CATALOG_QUEUE_SIZE", "20000")),
+)
+
+
+def ingest_products(results, brand=None):
+    """
+    Queue the products of an Inditex response for upserting into the catalog.
+
+    Best effort: a response that cannot be parsed is logged and skipped, it
+    never fails the search that returned it.
+    """
+    try:
+        rows = _product_rows(results, brand)
+    except Exception as e:
+        print(f"Error parsing products for the catalog: {e}")
+        return
+    for row in rows:
+        catalog_writer.submit(row)
+
+
+async def search_local(query, brand=None, page=1, per_page=10):
+    """
+    Full-text search over the local catalog.
+
+    Returns:
+        list: Products in the same shape as the Inditex API (``ProductBatch.to_list``).
+    """
+    params = {
+        "query": query,
+        "limit": per_page,
+        "offset": (page - 1) * per_page,
+    }
+    brand_filter = ""
+    if brand:
+        params["brand"] = brand.lower()
+        brand_filter = "AND brand = :brand"
+
+    stmt = text(f"""
+        SELECT product_id, name, brand, price_currency, price_current, price_original, link
+        FROM products, plainto_tsquery('simple', :query) AS q
+        WHERE search_vector @@ q {brand_filter}
+        ORDER BY ts_rank(search_vector, q) DESC, last_seen DESC
+        LIMIT :limit OFFSET :offset
+    """)
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(stmt, params)
+        rows = result.mappings().all()
+
+    return ProductBatch.from_columns(
+        # Inditex ids are numeric; keep the API's type in the response
+        [int(row["product_id"]) if row["product_id"].isdigit() else row["product_id"] for row in rows],
+        [row["name"] for row in rows],
+        [row["brand"] for row in rows],
+        [row["price_currency"] for row in rows],
+        [row["link"] for row in rows],
+        [row["price_current"] for row in rows],
+        [row["price_original"] for row in rows],
+    ).to_list()
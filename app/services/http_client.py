@@ -0,0 +1,118 @@
+"""
+Shared async HTTP clients for the upstream services.
+
+Every upstream (Inditex, freeimage.host, the agent service) gets its own
+``httpx.AsyncClient`` so that connection limits are applied per host and
+keep-alive connections are reused across requests instead of opening a new
+TCP/TLS connection for every call.
+"""
+import os
+import time
+from typing import Dict, Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 support in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+def _env_float(name, default):
+    return float(os.getenv(name, default))
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+# Per-upstream settings. Each value can be overridden with an environment
+# variable named <UPSTREAM>_<SETTING>, e.g. INDITEX_READ_TIMEOUT=10.
+UPSTREAMS = {
+    "inditex": {
+        "max_connections": _env_int("INDITEX_MAX_CONNECTIONS", 20),
+        "max_keepalive": _env_int("INDITEX_MAX_KEEPALIVE", 10),
+        "connect_timeout": _env_float("INDITEX_CONNECT_TIMEOUT", 5),
+        "read_timeout": _env_float("INDITEX_READ_TIMEOUT", 20),
+    },
+    "freeimage": {
+        "max_connections": _env_int("FREEIMAGE_MAX_CONNECTIONS", 10),
+        "max_keepalive": _env_int("FREEIMAGE_MAX_KEEPALIVE", 5),
+        "connect_timeout": _env_float("FREEIMAGE_CONNECT_TIMEOUT", 5),
+        "read_timeout": _env_float("FREEIMAGE_READ_TIMEOUT", 30),
+    },
+    "agent": {
+        "max_connections": _env_int("AGENT_MAX_CONNECTIONS", 20),
+        "max_keepalive": _env_int("AGENT_MAX_KEEPALIVE", 10),
+        "connect_timeout": _env_float("AGENT_CONNECT_TIMEOUT", 5),
+        "read_timeout": _env_float("AGENT_READ_TIMEOUT", 300),
+    },
+}
+
+KEEPALIVE_EXPIRY = _env_float("HTTP_KEEPALIVE_EXPIRY", 30)
+
+# Rate-limit headers older than this are not trusted any more
+QUOTA_MAX_AGE = _env_float("UPSTREAM_QUOTA_MAX_AGE", 60)
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+# upstream -> (remaining requests, monotonic time it was observed)
+_quota: Dict[str, tuple] = {}
+
+
+def _build_client(upstream):
+    settings = UPSTREAMS[upstream]
+    return httpx.AsyncClient(
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=settings["max_connections"],
+            max_keepalive_connections=settings["max_keepalive"],
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            settings["read_timeout"],
+            connect=settings["connect_timeout"],
+        ),
+    )
+
+
+def get_client(upstream: str) -> httpx.AsyncClient:
+    """
+    Return the pooled client for ``upstream`` ("inditex", "freeimage" or "agent").
+    """
+    client = _clients.get(upstream)
+    if client is None or client.is_closed:
+        client = _clients[upstream] = _build_client(upstream)
+    return client
+
+
+async def close_clients():
+    """Close every pooled client. Called on application shutdown."""
+    while _clients:
+        _, client = _clients.popitem()
+        await client.aclose()
+
+
+def record_quota(upstream: str, response: httpx.Response):
+    """
+    Remember the request quota ``upstream`` reported in ``response``
+    (``X-RateLimit-Remaining`` / ``RateLimit-Remaining``). A 429 means none is left.
+    """
+    if response.status_code == 429:
+        _quota[upstream] = (0, time.monotonic())
+        return
+    remaining = response.headers.get("x-ratelimit-remaining") or response.headers.get("ratelimit-remaining")
+    if remaining is None:
+        return
+    try:
+        _quota[upstream] = (int(float(remaining)), time.monotonic())
+    except ValueError:
+        pass
+
+
+def quota_remaining(upstream: str) -> Optional[int]:
+    """Last reported remaining quota of ``upstream``, or None if unknown or outdated."""
+    observed = _quota.get(upstream)
+    if observed is None or time.monotonic() - observed[1] > QUOTA_MAX_AGE:
+        return None
+    return observed[0]
@@ -0,0 +1,185 @@
+"""
+Local content-addressed store for uploaded search images.
+
+Images are saved under ``UPLOAD_DIR`` as ``<sha256><ext>``, so identical
+uploads are stored once. They are served from the ``/uploads`` mount only
+through short-lived HMAC-signed URLs, which is what we hand to the Inditex
+visual search API instead of uploading the image to a third-party host.
+Files are evicted when they get older than ``UPLOAD_STORE_MAX_AGE`` or when
+the store grows beyond ``UPLOAD_STORE_MAX_BYTES`` (oldest first).
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import time
+from urllib.parse import parse_qs, urlencode
+
+import aiofiles
+from fastapi.staticfiles import StaticFiles
+from starlette.responses import PlainTextResponse
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "static/uploads")
+# Public base URL of this API (e.g. https://cmatch.example.com). Inditex has to
+# be able to download the image, so without it we fall back to freeimage.host.
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+UPLOAD_URL_TTL = int(os.getenv("UPLOAD_URL_TTL", "600"))
+UPLOAD_STORE_MAX_BYTES = int(os.getenv("UPLOAD_STORE_MAX_BYTES", str(512 * 1024 * 1024)))
+UPLOAD_STORE_MAX_AGE = int(os.getenv("UPLOAD_STORE_MAX_AGE", str(24 * 3600)))
+UPLOAD_STORE_EVICT_INTERVAL = int(os.getenv("UPLOAD_STORE_EVICT_INTERVAL", "60"))
+
+_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+}
+
+
+class ImageStore:
+    """
+    Content-addressed image store with signed URLs and size/age eviction.
+    """
+
+    def __init__(self, directory, secret, base_url="", url_ttl=600,
+                 max_bytes=512 * 1024 * 1024, max_age=24 * 3600, evict_interval=60):
+        self.directory = directory
+        self._secret = (secret or "").encode()
+        self.base_url = base_url
+        self.url_ttl = url_ttl
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_interval = evict_interval
+        self._last_eviction = 0.0
+        self._eviction = None
+
+        self.saved = 0
+        self.deduplicated = 0
+        self.evicted = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def public(self):
+        """Whether stored images can be reached by upstream services."""
+        return bool(self.base_url and self._secret)
+
+    async def save(self, content, content_type=None, digest=None):
+        """
+        Store ``content`` and return its file name.
+
+        Args:
+            content: Raw image bytes.
+            content_type: MIME type of the upload, used for the file extension.
+            digest: SHA-256 hex digest of ``content`` if already computed.
+        """
+        digest = digest or hashlib.sha256(content).hexdigest()
+        name = digest + _EXTENSIONS.get((content_type or "").lower(), ".jpg")
+        path = os.path.join(self.directory, name)
+
+        if os.path.exists(path):
+            # Already stored: refresh its age so it is not evicted while in use
+            os.utime(path)
+            self.deduplicated += 1
+        else:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            async with aiofiles.open(tmp_path, "wb") as f:
+                await f.write(content)
+            os.replace(tmp_path, path)
+            self.saved += 1
+
+        self._schedule_eviction()
+        return name
+
+    def _signature(self, name, expires):
+        mac = hmac.new(self._secret, f"{name}:{expires}".encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(mac[:18]).decode()
+
+    def signed_url(self, name, ttl=None):
+        """Absolute URL for ``name`` valid for ``ttl`` seconds."""
+        expires = int(time.time()) + (self.url_ttl if ttl is None else ttl)
+        query = urlencode({"expires": expires, "signature": self._signature(name, expires)})
+        return f"{self.base_url}/uploads/{name}?{query}"
+
+    def verify(self, name, expires, signature):
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return False
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self._signature(name, expires), signature or "")
+
+    def _schedule_eviction(self):
+        now = time.monotonic()
+        if now - self._last_eviction < self.evict_interval:
+            return
+        if self._eviction is not None and not self._eviction.done():
+            return
+        self._last_eviction = now
+        self._eviction = asyncio.ensure_future(asyncio.to_thread(self.evict))
+
+    def evict(self):
+        """Delete expired files, then the oldest ones until under ``max_bytes``."""
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if now - stat.st_mtime > self.max_age:
+                self._remove(entry.path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            self.evicted += 1
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        return {
+            "public": self.public,
+            "saved": self.saved,
+            "deduplicated": self.deduplicated,
+            "evicted": self.evicted,
+        }
+
+
+class SignedStaticFiles(StaticFiles):
+    """
+    ``StaticFiles`` that only serves files from ``store`` with a valid signature.
+    """
+
+    def __init__(self, *, store, **kwargs):
+        super().__init__(directory=store.directory, **kwargs)
+        self.store = store
+
+    async def get_response(self, path, scope):
+        query = parse_qs(scope.get("query_string", b"").decode())
+        expires = query.get("expires", [None])[0]
+        signature = query.get("signature", [None])[0]
+        if not self.store.verify(path, expires, signature):
+            return PlainTextResponse("Forbidden", status_code=403)
+        return await super().get_response(path, scope)
+
+
+image_store = ImageStore(
+    UPLOAD_DIR,
+    secret=os.getenv("UPLOAD_SIGNING_KEY") or os.getenv("SECRET_KEY"),
+    base_url=PUBLIC_BASE_URL,
+    url_ttl=UPLOAD_URL_TTL,
+    max_bytes=UPLOAD_STORE_MAX_BYTES,
+    max_age=UPLOAD_STORE_MAX_AGE,
+    evict_interval=UPLOAD_STORE_EVICT_INTERVAL,
+)
@@ -0,0 +1,193 @@
+"""
+Speculative next-page prefetch.
+
+When page ``n`` of a search is served, pages ``n+1..n+PREFETCH_DEPTH`` are
+loaded in the background into the result caches so that a "next page" click
+is a cache hit. Prefetching is best effort:
+
+* at most ``PREFETCH_CONCURRENCY`` prefetches run at once across the process;
+  when the budget is used up new prefetches are dropped, not queued,
+* nothing is prefetched while the upstream reports less than
+  ``PREFETCH_MIN_QUOTA`` remaining requests,
+* pages that are already cached are skipped.
+
+Every prefetched page is remembered for ``PREFETCH_TRACK_TTL`` seconds. A
+request for it within that window counts as a hit, otherwise as waste.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+from .http_client import quota_remaining
+from .rate_governor import request_priority, PREFETCH
+from .resilience import deadline
+
+PREFETCH_DEPTH = int(os.getenv("PREFETCH_DEPTH", "1"))
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "4"))
+PREFETCH_MIN_QUOTA = int(os.getenv("PREFETCH_MIN_QUOTA", "50"))
+PREFETCH_TRACK_TTL = float(os.getenv("PREFETCH_TRACK_TTL", "300"))
+PREFETCH_DEADLINE = float(os.getenv("PREFETCH_DEADLINE", "30"))
+
+
+class Prefetcher:
+    """
+    Runs best-effort background loads and measures whether they were used.
+
+    Args:
+        depth: Pages to prefetch after the one being served (0 disables).
+        concurrency: Maximum prefetches in flight.
+        min_quota: Minimum remaining upstream quota needed to prefetch.
+        track_ttl: Seconds a prefetched page may wait for its request before
+            it counts as wasted.
+        upstream: Upstream whose quota is checked.
+    """
+
+    def __init__(self, depth=PREFETCH_DEPTH, concurrency=PREFETCH_CONCURRENCY,
+                 min_quota=PREFETCH_MIN_QUOTA, track_ttl=PREFETCH_TRACK_TTL, upstream="inditex"):
+        self.depth = depth
+        self.concurrency = concurrency
+        self.min_quota = min_quota
+        self.track_ttl = track_ttl
+        self.upstream = upstream
+        self._inflight = {}
+        # In-flight prefetches whose page was already requested
+        self._claimed_inflight = set()
+        # key -> time after which an unclaimed prefetch counts as wasted
+        self._unclaimed = OrderedDict()
+
+        self.scheduled = 0
+        self.completed = 0
+        self.failed = 0
+        self.skipped_cached = 0
+        self.skipped_budget = 0
+        self.skipped_quota = 0
+        self.hits = 0
+        self.wasted = 0
+
+    def pages_after(self, page):
+        """The pages to prefetch after serving ``page``."""
+        return range(page + 1, page + 1 + max(self.depth, 0))
+
+    def schedule(self, key, load, is_cached=None):
+        """
+        Prefetch ``key`` in the background, if the budget and quota allow it.
+
+        Args:
+            key: Hashable identity of the page (also used by :meth:`claim`).
+            load: ``async load()`` that fetches the page into its cache; a
+                None result counts as a failure.
+            is_cached: Optional ``is_cached()`` returning True when the page
+                is already cached and fresh.
+
+        Returns:
+            bool: Whether a prefetch was started.
+        """
+        self._expire()
+        if key in self._inflight or key in self._unclaimed:
+            return False
+        if is_cached is not None and is_cached():
+            self.skipped_cached += 1
+            return False
+        if len(self._inflight) >= self.concurrency:
+            self.skipped_budget += 1
+            return False
+        remaining = quota_remaining(self.upstream)
+        if remaining is not None and remaining < self.min_quota:
+            self.skipped_quota += 1
+            return False
+
+        self.scheduled += 1
+        # Own deadline: the prefetch outlives the request that triggered it
+        with request_priority(PREFETCH), deadline(PREFETCH_DEADLINE, inherit=False):
+            self._inflight[key] = asyncio.ensure_future(self._run(key, load))
+        return True
+
+    def after(self, key, page, load, is_cached=None):
+        """
+        Prefetch the pages that follow ``page``.
+
+        Args:
+            key: Tuple identifying the search; the page number is appended.
+            page: The page being served.
+            load: ``async load(page)`` fetching one page into its cache.
+            is_cached: Optional ``is_cached(page)``.
+        """
+        for next_page in self.pages_after(page):
+            self.schedule(
+                key + (next_page,),
+                lambda p=next_page: load(p),
+                None if is_cached is None else (lambda p=next_page: is_cached(p)),
+            )
+
+    async def _run(self, key, load):
+        try:
+            result = await load()
+        except Exception as e:
+            print(f"Prefetch failed: {e}")
+            result = None
+        finally:
+            self._inflight.pop(key, None)
+        claimed = key in self._claimed_inflight
+        self._claimed_inflight.discard(key)
+        if result is None:
+            self.failed += 1
+            return
+        self.completed += 1
+        if not claimed:
+            self._unclaimed[key] = time.monotonic() + self.track_ttl
+
+    def claim(self, key):
+        """
+        Record that ``key`` is being requested. Returns True (and counts a hit)
+        when it was prefetched.
+        """
+        self._expire()
+        if self._unclaimed.pop(key, None) is not None:
+            self.hits += 1
+            return True
+        if key in self._inflight and key not in self._claimed_inflight:
+            # Requested while still loading: the upstream call is already under way
+            self._claimed_inflight.add(key)
+            self.hits += 1
+            return True
+        return False
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._unclaimed:
+            key, deadline = next(iter(self._unclaimed.items()))
+            if deadline > now:
+                break
+            del self._unclaimed[key]
+            self.wasted += 1
+
+    async def stop(self):
+        """Cancel the prefetches in flight (called on shutdown)."""
+        tasks = list(self._inflight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        self._expire()
+        resolved = self.hits + self.wasted
+        return {
+            "depth": self.depth,
+            "inflight": len(self._inflight),
+            "scheduled": self.scheduled,
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped_cached": self.skipped_cached,
+            "skipped_budget": self.skipped_budget,
+            "skipped_quota": self.skipped_quota,
+            "pending": len(self._unclaimed),
+            "hits": self.hits,
+            "wasted": self.wasted,
+            "hit_rate": round(self.hits / resolved, 4) if resolved else 0.0,
+            "waste_rate": round(self.wasted / self.completed, 4) if self.completed else 0.0,
+            "upstream_quota": quota_remaining(self.upstream),
+        }
+
+
+prefetcher = Prefetcher()
@@ -0,0 +1,200 @@
+"""
+Disk-backed cache of rendered product previews.
+
+Each preview is stored as a JPEG under ``PREVIEW_CACHE_DIR``, keyed by the
+item id and product URL. Files older than ``PREVIEW_CACHE_TTL`` are treated
+as missing, and when the cache grows beyond ``PREVIEW_CACHE_MAX_BYTES`` the
+least recently served files are deleted (the access time is updated on
+every hit).
+"""
+import asyncio
+import hashlib
+import os
+import time
+
+import aiofiles
+
+PREVIEW_CACHE_DIR = os.getenv("PREVIEW_CACHE_DIR", "cache/previews")
+PREVIEW_CACHE_TTL = int(os.getenv("PREVIEW_CACHE_TTL", str(7 * 24 * 3600)))
+PREVIEW_CACHE_MAX_BYTES = int(os.getenv("PREVIEW_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+PREVIEW_CACHE_EVICT_INTERVAL = int(os.getenv("PREVIEW_CACHE_EVICT_INTERVAL", "60"))
+
+
+class Preview:
+    __slots__ = ("data", "etag")
+
+    def __init__(self, data, etag):
+        self.data = data
+        self.etag = etag
+
+
+class PreviewCache:
+    """
+    JPEG previews on disk with a TTL and an LRU size cap.
+    """
+
+    def __init__(self, directory, ttl=PREVIEW_CACHE_TTL, max_bytes=PREVIEW_CACHE_MAX_BYTES,
+                 evict_interval=PREVIEW_CACHE_EVICT_INTERVAL):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+        self._rendering = {}
+        self._last_eviction = 0.0
+        self._eviction = None
+
+        self.hits = 0
+        self.misses = 0
+        self.render_failures = 0
+        self.evicted = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, item_id, url):
+        key = hashlib.sha256(f"{item_id}\n{url}".encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], f"{key}.jpg")
+
+    def _fresh_stat(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if time.time() - stat.st_mtime > self.ttl:
+            return None
+        return stat
+
+    @staticmethod
+    def _etag(path, stat):
+        # Changes whenever the preview is re-rendered, without reading the file
+        name = os.path.splitext(os.path.basename(path))[0]
+        return f'"{name[:16]}-{int(stat.st_mtime)}-{stat.st_size}"'
+
+    def not_modified(self, item_id, url, if_none_match):
+        """
+        Return the ETag of the cached preview if it matches ``if_none_match``
+        (so the client copy is still valid), otherwise None.
+        """
+        if not if_none_match:
+            return None
+        path = self._path(item_id, url)
+        stat = self._fresh_stat(path)
+        if stat is None:
+            return None
+        etag = self._etag(path, stat)
+        if etag not in (tag.strip() for tag in if_none_match.split(",")):
+            return None
+        self._touch(path, stat)
+        self.hits += 1
+        return etag
+
+    async def get(self, item_id, url):
+        """Return the cached :class:`Preview`, or None."""
+        path = self._path(item_id, url)
+        stat = self._fresh_stat(path)
+        if stat is None:
+            return None
+        try:
+            async with aiofiles.open(path, "rb") as f:
+                data = await f.read()
+        except FileNotFoundError:
+            # Evicted between the stat and the read
+            return None
+        self._touch(path, stat)
+        return Preview(data, self._etag(path, stat))
+
+    async def put(self, item_id, url, data):
+        path = self._path(item_id, url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        async with aiofiles.open(tmp_path, "wb") as f:
+            await f.write(data)
+        os.replace(tmp_path, path)
+        self._schedule_eviction()
+        return Preview(data, self._etag(path, os.stat(path)))
+
+    async def get_or_render(self, item_id, url, render):
+        """
+        Return the cached preview or render it with ``await render(url)``.
+
+        Concurrent requests for the same preview share a single render.
+        Returns None if rendering fails.
+        """
+        preview = await self.get(item_id, url)
+        if preview is not None:
+            self.hits += 1
+            return preview
+
+        self.misses += 1
+        path = self._path(item_id, url)
+        task = self._rendering.get(path)
+        if task is None:
+            task = asyncio.ensure_future(self._render(item_id, url, render))
+            self._rendering[path] = task
+            task.add_done_callback(lambda _: self._rendering.pop(path, None))
+        return await asyncio.shield(task)
+
+    async def _render(self, item_id, url, render):
+        data = await render(url)
+        if not data:
+            self.render_failures += 1
+            return None
+        return await self.put(item_id, url, data)
+
+    @staticmethod
+    def _touch(path, stat):
+        # Record the access for LRU eviction while keeping the mtime used by the TTL
+        try:
+            os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            pass
+
+    def _schedule_eviction(self):
+        now = time.monotonic()
+        if now - self._last_eviction < self.evict_interval:
+            return
+        if self._eviction is not None and not self._eviction.done():
+            return
+        self._last_eviction = now
+        self._eviction = asyncio.ensure_future(asyncio.to_thread(self.evict))
+
+    def evict(self):
+        """Delete expired previews, then the least recently used until under ``max_bytes``."""
+        now = time.time()
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.ttl:
+                    self._remove(path)
+                else:
+                    files.append((stat.st_atime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            self.evicted += 1
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "render_failures": self.render_failures,
+            "evicted": self.evicted,
+        }
+
+
+preview_cache = PreviewCache(PREVIEW_CACHE_DIR)
@@ -0,0 +1,230 @@
+"""
+Profile-aware re-ranking of search results.
+
+With ``rank=profile`` the search endpoints fetch a window of upstream pages,
+merge them into a ``ProductBatch`` and score every product in one vectorized
+pass against the caller's profile:
+
+* brand in ``favorite_brands``,
+* ``preferred_colors`` / ``style_preferences`` tokens in the product name,
+* price close to the typical price of the user's closet (log scale).
+
+A small position term keeps Inditex's own relevance order as the tie-breaker.
+Upstream pages are ranked in fixed blocks of ``RANK_WINDOW_PAGES`` pages:
+ranked pages ``1..W`` are slices of the ranked pool of upstream pages
+``1..W``, ranked pages ``W+1..2W`` of upstream pages ``W+1..2W``, and so on
+up to ``RANK_MAX_PAGES``. Every page of a block slices the same pool, so
+paging never repeats or skips a product; upstream pages go through the search
+caches, so the pages of a block are only fetched once.
+"""
+import asyncio
+import math
+import os
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+from models.product import ProductBatch
+
+from ..database import AsyncSessionLocal
+from .cache import TTLCache
+
+RANK_WINDOW_PAGES = int(os.getenv("RANK_WINDOW_PAGES", "3"))
+RANK_MAX_PAGES = int(os.getenv("RANK_MAX_PAGES", "9"))
+
+RANK_BRAND_WEIGHT = float(os.getenv("RANK_BRAND_WEIGHT", "2.0"))
+RANK_COLOR_WEIGHT = float(os.getenv("RANK_COLOR_WEIGHT", "1.5"))
+RANK_STYLE_WEIGHT = float(os.getenv("RANK_STYLE_WEIGHT", "0.75"))
+RANK_PRICE_WEIGHT = float(os.getenv("RANK_PRICE_WEIGHT", "1.0"))
+RANK_POSITION_WEIGHT = float(os.getenv("RANK_POSITION_WEIGHT", "0.5"))
+
+# Smallest price band (log scale) for users with a very uniform closet
+MIN_PRICE_BAND = 0.25
+
+PROFILE_QUERY = text("""
+    SELECT
+        u.favorite_brands,
+        u.preferred_colors,
+        u.style_preferences,
+        (SELECT percentile_cont(ARRAY[0.25, 0.5, 0.75]) WITHIN GROUP (ORDER BY c.price)
+         FROM closet c
+         WHERE c.user_id = u.user_id AND c.price > 0) AS closet_prices
+    FROM users u
+    WHERE u.user_id = :user_id
+""")
+
+
+def _tokens(values):
+    """Lowercased, de-duplicated, non-empty preference tokens."""
+    tokens = []
+    for value in values or ():
+        token = str(value).strip().lower()
+        if token and token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+class RankingProfile:
+    """The parts of a user profile that the scorer needs."""
+    __slots__ = ("brands", "colors", "styles", "price_center", "price_band")
+
+    def __init__(self, brands=(), colors=(), styles=(), closet_prices=None):
+        self.brands = np.array(_tokens(brands), dtype=str)
+        self.colors = _tokens(colors)
+        self.styles = _tokens(styles)
+        self.price_center = None
+        self.price_band = None
+        if closet_prices and all(price is not None for price in closet_prices):
+            q25, median, q75 = (float(price) for price in closet_prices)
+            self.price_center = math.log(median)
+            self.price_band = max(math.log(q75 / q25) / 2, MIN_PRICE_BAND)
+
+    @property
+    def empty(self):
+        return not (len(self.brands) or self.colors or self.styles or self.price_center is not None)
+
+
+def _contains_any(names, tokens):
+    """Number of ``tokens`` found in each name."""
+    hits = np.zeros(len(names), dtype=np.float64)
+    for token in tokens:
+        hits += np.char.find(names, token) >= 0
+    return hits
+
+
+def score_batch(batch: ProductBatch, profile: RankingProfile) -> np.ndarray:
+    """
+    Score every product of ``batch`` against ``profile``.
+
+    Returns:
+        np.ndarray: One float score per product (higher is better).
+    """
+    n = len(batch)
+    scores = np.zeros(n, dtype=np.float64)
+    if n == 0:
+        return scores
+
+    if len(profile.brands):
+        brands = np.char.lower(batch.brands.astype(str))
+        scores += RANK_BRAND_WEIGHT * np.isin(brands, profile.brands)
+
+    if profile.colors or profile.styles:
+        names = np.char.lower(batch.names.astype(str))
+        if profile.colors:
+            # Any matching color counts once; extra colors are a weak bonus
+            color_hits = _contains_any(names, profile.colors)
+            scores += RANK_COLOR_WEIGHT * np.minimum(color_hits, 1) + 0.1 * np.maximum(color_hits - 1, 0)
+        if profile.styles:
+            scores += RANK_STYLE_WEIGHT * np.minimum(_contains_any(names, profile.styles), 1)
+
+    if profile.price_center is not None:
+        prices = batch.price_current
+        with np.errstate(invalid="ignore", divide="ignore"):
+            distance = (np.log(prices) - profile.price_center) / profile.price_band
+            price_score = np.exp(-0.5 * distance ** 2)
+        scores += RANK_PRICE_WEIGHT * np.nan_to_num(price_score, nan=0.0)
+
+    # Upstream relevance as the tie-breaker: 1 for the first result, ~0 for the last
+    scores += RANK_POSITION_WEIGHT * (1.0 - np.arange(n, dtype=np.float64) / n)
+    return scores
+
+
+class ProfileRanker:
+    """
+    Loads ranking profiles (cached per user) and re-ranks windows of search
+    results with them.
+    """
+
+    def __init__(self, window_pages=RANK_WINDOW_PAGES, max_pages=RANK_MAX_PAGES, profile_ttl=300):
+        self.window_pages = max(1, window_pages)
+        self.max_pages = max(self.window_pages, max_pages)
+        self.profiles = TTLCache(
+            "ranking_profiles",
+            maxsize=int(os.getenv("RANK_PROFILE_CACHE_SIZE", "4096")),
+            ttl=profile_ttl,
+        )
+        self.ranked_requests = 0
+        self.unranked_requests = 0
+        self.upstream_pages = 0
+        self.scored_products = 0
+        self.score_time = 0.0
+
+    async def _load_profile(self, user_id):
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(PROFILE_QUERY, {"user_id": user_id})).mappings().first()
+        if row is None:
+            return RankingProfile()
+        return RankingProfile(
+            brands=row["favorite_brands"],
+            colors=row["preferred_colors"],
+            styles=row["style_preferences"],
+            closet_prices=row["closet_prices"],
+        )
+
+    async def profile(self, user_id) -> RankingProfile:
+        return await self.profiles.get_or_load(user_id, lambda: self._load_profile(user_id))
+
+    def invalidate(self, user_id):
+        """Drop the cached profile of ``user_id`` (call after a profile update)."""
+        self.profiles.invalidate(user_id)
+
+    def rank(self, batch: ProductBatch, profile: RankingProfile) -> ProductBatch:
+        """``batch`` ordered by descending profile score."""
+        started = time.perf_counter()
+        ranked = batch.sort_by(score_batch(batch, profile), descending=True)
+        self.score_time += time.perf_counter() - started
+        self.scored_products += len(batch)
+        return ranked
+
+    async def search(self, fetch_page, user_id, page=1, per_page=10):
+        """
+        Ranked page ``page`` of a search.
+
+        Args:
+            fetch_page: ``async fetch_page(upstream_page)`` returning the Inditex
+                result list of that page (or None on error).
+            user_id: Whose profile to rank with.
+            page: Ranked page number (1-based).
+            per_page: Products per page, both upstream and in the response.
+
+        Returns:
+            list: Products in the Inditex format (empty past
+            ``RANK_MAX_PAGES``), or None if every upstream page failed.
+        """
+        profile = await self.profile(user_id)
+        if profile.empty:
+            # Nothing to rank with: plain upstream order
+            self.unranked_requests += 1
+            return await fetch_page(page)
+
+        # The block of upstream pages this ranked page belongs to
+        block = (page - 1) // self.window_pages
+        first_page = block * self.window_pages + 1
+        pages = range(first_page, min(first_page + self.window_pages - 1, self.max_pages) + 1)
+        if not pages:
+            return []
+        responses = await asyncio.gather(*(fetch_page(p) for p in pages), return_exceptions=True)
+        pages_ok = [r for r in responses if isinstance(r, list)]
+        self.upstream_pages += len(pages)
+        if not pages_ok:
+            return None
+
+        self.ranked_requests += 1
+        pool = ProductBatch.concat(ProductBatch.from_inditex(r) for r in pages_ok).dedupe()
+        ranked = self.rank(pool, profile)
+        start = ((page - 1) % self.window_pages) * per_page
+        return ranked.take(np.arange(start, min(start + per_page, len(ranked)))).to_list()
+
+    def stats(self):
+        return {
+            "ranked_requests": self.ranked_requests,
+            "unranked_requests": self.unranked_requests,
+            "upstream_pages": self.upstream_pages,
+            "scored_products": self.scored_products,
+            "avg_score_ms": round(1000 * self.score_time / self.ranked_requests, 3) if self.ranked_requests else 0.0,
+            "profiles": self.profiles.stats(),
+        }
+
+
+ranker = ProfileRanker()
@@ -0,0 +1,274 @@
+"""
+Client-side rate governor for the Inditex API.
+
+Each Inditex endpoint (token, product search, visual search) gets a token
+bucket refilled at ``INDITEX_<ENDPOINT>_RATE`` requests per second, with
+bursts of up to ``INDITEX_<ENDPOINT>_BURST``. A call that finds the bucket
+empty is queued, not failed. Queued calls are released by priority:
+interactive user requests first, then prefetches, then background refreshes.
+The priority comes from a context variable, so it follows the call through
+``asyncio`` tasks (see :func:`request_priority`).
+
+The rate adapts to the responses (AIMD):
+
+* a 429 halves the rate (down to ``min_rate``) and pauses the bucket for
+  ``Retry-After`` seconds, or for an exponential backoff if there is no header,
+* every successful response adds back a small fraction of the configured rate.
+
+:meth:`RateGovernor.send` retries 429 responses through the governor, so
+callers only see a 429 once the retries are used up.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+from .resilience import remaining
+
+INTERACTIVE = 0
+PREFETCH = 1
+BACKGROUND = 2
+
+_priority = contextvars.ContextVar("inditex_request_priority", default=INTERACTIVE)
+
+# Longest a call may wait in the queue, per priority
+MAX_WAIT = {
+    INTERACTIVE: float(os.getenv("INDITEX_MAX_QUEUE_WAIT", "20")),
+    PREFETCH: float(os.getenv("INDITEX_PREFETCH_MAX_QUEUE_WAIT", "5")),
+    BACKGROUND: float(os.getenv("INDITEX_BACKGROUND_MAX_QUEUE_WAIT", "30")),
+}
+MAX_RETRIES = int(os.getenv("INDITEX_MAX_429_RETRIES", "3"))
+# Fraction of the configured rate restored by each successful response
+RATE_INCREASE = float(os.getenv("INDITEX_RATE_INCREASE", "0.05"))
+RATE_DECREASE = float(os.getenv("INDITEX_RATE_DECREASE", "0.5"))
+MAX_BACKOFF = float(os.getenv("INDITEX_MAX_BACKOFF", "60"))
+
+
+class RateLimitExceeded(Exception):
+    """A call waited longer than its priority allows for the rate governor."""
+
+
+@contextmanager
+def request_priority(level):
+    """
+    Run the enclosed code (and the tasks it creates) with priority ``level``.
+    """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a ``Retry-After`` header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+class RateGovernor:
+    """
+    Token bucket with a priority queue and adaptive rate.
+
+    Args:
+        name: Name used in the metrics.
+        rate: Configured (maximum) requests per second.
+        burst: Bucket size; defaults to one second worth of requests.
+        min_rate: Lowest rate the adaptation may reach.
+    """
+
+    def __init__(self, name, rate, burst=None, min_rate=None):
+        self.name = name
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 20
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._consecutive_429 = 0
+        self._last_decrease = 0.0
+
+        # Heap of (priority, sequence, future)
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._dispatcher = None
+
+        self.granted = 0
+        self.queued = 0
+        self.timeouts = 0
+        self.throttled = 0
+        self.retries = 0
+        self.wait_time = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _try_take(self):
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return False
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def _delay(self):
+        """Seconds until the next token may be taken."""
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return max((1 - self.tokens) / self.rate, 0.001)
+
+    def try_acquire(self):
+        """Take a token only if one is available right now (never queues)."""
+        if not self._waiters and self._try_take():
+            self.granted += 1
+            return True
+        return False
+
+    async def acquire(self, priority=None):
+        """
+        Wait for permission to send one request.
+
+        Raises:
+            RateLimitExceeded: If the wait exceeds ``MAX_WAIT`` for the priority
+                or the request's deadline.
+        """
+        priority = current_priority() if priority is None else priority
+        if self.try_acquire():
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self.queued += 1
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+        max_wait = MAX_WAIT.get(priority, MAX_WAIT[INTERACTIVE])
+        left = remaining()
+        if left is not None:
+            max_wait = max(min(max_wait, left), 0)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(future, max_wait)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise RateLimitExceeded(
+                f"{self.name}: waited more than {max_wait:.1f}s for the Inditex rate limit"
+            )
+        finally:
+            self.wait_time += time.monotonic() - started
+        self.granted += 1
+
+    async def _dispatch(self):
+        """Hand out tokens to queued calls, highest priority first."""
+        while self._waiters:
+            future = self._waiters[0][2]
+            if future.done():
+                # Timed out or cancelled while queued
+                heapq.heappop(self._waiters)
+                continue
+            if self._try_take():
+                heapq.heappop(self._waiters)
+                future.set_result(None)
+                continue
+            await asyncio.sleep(self._delay())
+
+    def observe(self, response):
+        """Adapt the rate to an upstream response."""
+        now = time.monotonic()
+        if response.status_code == 429:
+            self.throttled += 1
+            self._consecutive_429 += 1
+            retry_after = parse_retry_after(response.headers.get("retry-after"))
+            if retry_after is None:
+                retry_after = min(2 ** (self._consecutive_429 - 1), MAX_BACKOFF)
+            self.blocked_until = max(self.blocked_until, now + min(retry_after, MAX_BACKOFF))
+            self.tokens = 0
+            # Several 429s of the same burst count as one decrease
+            if now - self._last_decrease >= 1:
+                self.rate = max(self.min_rate, self.rate * RATE_DECREASE)
+                self._last_decrease = now
+        elif response.status_code < 400:
+            self._consecutive_429 = 0
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_INCREASE)
+
+    async def send(self, send_request, retries=MAX_RETRIES):
+        """
+        Send a request through the governor, retrying 429 responses.
+
+        Args:
+            send_request: Zero-argument coroutine function returning an
+                ``httpx.Response``.
+            retries: How many 429 responses to retry.
+
+        Returns:
+            httpx.Response: The first non-429 response, or the last 429.
+        """
+        attempt = 0
+        while True:
+            await self.acquire()
+            response = await send_request()
+            self.observe(response)
+            if response.status_code != 429 or attempt >= retries:
+                return response
+            attempt += 1
+            self.retries += 1
+
+    def stats(self):
+        self._refill(time.monotonic())
+        return {
+            "rate": round(self.rate, 3),
+            "max_rate": self.max_rate,
+            "tokens": round(self.tokens, 2),
+            "queue_depth": sum(1 for _, _, f in self._waiters if not f.done()),
+            "blocked_for": round(max(self.blocked_until - time.monotonic(), 0.0), 2),
+            "granted": self.granted,
+            "queued": self.queued,
+            "timeouts": self.timeouts,
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "avg_wait": round(self.wait_time / self.queued, 4) if self.queued else 0.0,
+        }
+
+
+def _governor(name, env_prefix, rate):
+    rate = float(os.getenv(f"{env_prefix}_RATE", rate))
+    burst = os.getenv(f"{env_prefix}_BURST")
+    return RateGovernor(name, rate, burst=float(burst) if burst else None)
+
+
+governors = {
+    "token": _governor("token", "INDITEX_TOKEN", "1"),
+    "product_search": _governor("product_search", "INDITEX_PRODUCT_SEARCH", "10"),
+    "visual_search": _governor("visual_search", "INDITEX_VISUAL_SEARCH", "5"),
+}
+
+
+def get_governor(endpoint):
+    """Governor of an Inditex endpoint ("token", "product_search" or "visual_search")."""
+    return governors[endpoint]
+
+
+def stats():
+    return {name: governor.stats() for name, governor in governors.items()}
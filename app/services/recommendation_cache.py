@@ -0,0 +1,183 @@
+"""
+Cache of agent recommendations.
+
+An agent run (several LLM calls plus product searches) is by far the most
+expensive request we serve, and many prompts are repeats in different words.
+Answers are cached under
+
+* the normalized query: lowercased, accents and punctuation removed, stop
+  words (English and Spanish) dropped, and plurals and common synonyms
+  folded, so "Show me some summer wedding outfits" and "summer wedding
+  outfit" share an entry. Word order is kept: "black shirt, white pants" and
+  "white shirt, black pants" are different requests, and
+* a fingerprint of the profile fields the agent personalizes with
+  (``favorite_brands``, ``preferred_colors``, ``usual_sizes``).
+
+Users with identical preferences share entries. Entries expire after
+``RECOMMENDATION_CACHE_TTL`` seconds and the cache is LRU-bounded by
+``RECOMMENDATION_CACHE_SIZE``. Updating a profile drops that user's
+fingerprint and the entries cached under it.
+"""
+import hashlib
+import json
+import os
+import re
+import unicodedata
+
+from sqlalchemy import text
+
+from ..database import AsyncSessionLocal
+from .cache import TTLCache
+
+# Negations and comparisons (no, sin, under, more, most...) change the request and
+# are deliberately not stop words
+STOP_WORDS = frozenset("""
+    a about all also am an and any are as at be been being both but by
+    can could did do does doing for from further get give had has have having he her here hers him his
+    how i if in into is it its just like looking me might must my need needs now
+    of off on once only or other our out please recommend recommendation recommendations she should
+    show so some something such suggest than that the their them then there these they this those through
+    to too until up us very want was we were what when where which while who whom why will with
+    would you your yours
+    al algo algun alguna alguno como con cual cuando de del desde donde el ella ellos en era es esa
+    ese eso esta este esto estoy fue ha hay la las le les lo los me mi mis muy necesito nos o otra
+    otro para pero por porque puedes que quiero se sea ser si sobre su sus te tengo ti tu tus un una
+    uno unos unas y ya
+""".split())
+
+# Words folded onto one term (after plural folding)
+SYNONYMS = {
+    "tee": "tshirt", "tees": "tshirt", "t": "tshirt", "camiseta": "tshirt",
+    "pant": "trouser", "slack": "trouser", "pantalon": "trouser",
+    "trainer": "sneaker", "zapatilla": "sneaker",
+    "jumper": "sweater", "pullover": "sweater", "jersey": "sweater",
+    "look": "outfit", "conjunto": "outfit", "attire": "outfit",
+    "clothes": "clothing", "clothe": "clothing", "ropa": "clothing",
+    "vestido": "dress", "falda": "skirt", "chaqueta": "jacket", "abrigo": "coat",
+    "boda": "wedding", "verano": "summer", "invierno": "winter", "fiesta": "party",
+}
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+PROFILE_QUERY = text("""
+    SELECT favorite_brands, preferred_colors, usual_sizes
+    FROM users
+    WHERE user_id = :user_id
+""")
+
+
+def _fold_plural(word):
+    """Crude English/Spanish singular: good enough to match cache keys."""
+    if len(word) <= 3 or word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("sses", "shes", "ches", "xes", "ones")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def normalize_recommendation_query(query):
+    """
+    Canonical form of a recommendation prompt: its meaningful, folded terms
+    in their original order (repeats dropped).
+    """
+    decomposed = unicodedata.normalize("NFKD", (query or "").lower())
+    plain = "".join(c for c in decomposed if not unicodedata.combining(c))
+    terms = []
+    for word in _WORD.findall(plain.replace("t-shirt", "tshirt")):
+        if word in STOP_WORDS:
+            continue
+        word = SYNONYMS.get(word, word)
+        word = SYNONYMS.get(_fold_plural(word), _fold_plural(word))
+        if word not in terms:
+            terms.append(word)
+    return " ".join(terms)
+
+
+def profile_fingerprint(favorite_brands=None, preferred_colors=None, usual_sizes=None):
+    """Stable hash of the profile fields that personalize recommendations."""
+    if isinstance(usual_sizes, str):
+        try:
+            usual_sizes = json.loads(usual_sizes)
+        except ValueError:
+            usual_sizes = None
+    payload = {
+        "brands": sorted({b.strip().lower() for b in favorite_brands or () if b and b.strip()}),
+        "colors": sorted({c.strip().lower() for c in preferred_colors or () if c and c.strip()}),
+        "sizes": {k: v for k, v in (usual_sizes or {}).items() if v},
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:16]
+
+
+class RecommendationCache:
+    """
+    Agent answers keyed by (profile fingerprint, normalized query).
+
+    Args:
+        maxsize: Maximum number of cached answers.
+        ttl: Seconds an answer is served.
+    """
+
+    def __init__(self, maxsize=1000, ttl=3600):
+        self.answers = TTLCache("agent_recommendations", maxsize=maxsize, ttl=ttl)
+        # user_id -> profile fingerprint
+        self.fingerprints = TTLCache("profile_fingerprints", maxsize=maxsize, ttl=ttl)
+        self.invalidations = 0
+
+    async def _load_fingerprint(self, user_id):
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(PROFILE_QUERY, {"user_id": user_id})).mappings().first()
+        if row is None:
+            return profile_fingerprint()
+        return profile_fingerprint(row["favorite_brands"], row["preferred_colors"], row["usual_sizes"])
+
+    async def key(self, user_id, query):
+        """Cache key of ``query`` asked by ``user_id``, or None if it cannot be cached."""
+        normalized = normalize_recommendation_query(query)
+        if not normalized:
+            return None
+        try:
+            fingerprint = await self.fingerprints.get_or_load(user_id, lambda: self._load_fingerprint(user_id))
+        except Exception as e:
+            # Without the profile we cannot share answers safely: skip the cache
+            print(f"Error loading profile fingerprint for user {user_id}: {e}")
+            return None
+        return (fingerprint, normalized)
+
+    def get(self, key):
+        if key is None:
+            return None
+        return self.answers.get(key)
+
+    def set(self, key, answer):
+        """Cache a successful agent answer (error answers are not cached)."""
+        if key is None or not isinstance(answer, dict) or answer.get("status") == "error":
+            return
+        self.answers.set(key, answer)
+
+    def invalidate_user(self, user_id):
+        """Forget the user's fingerprint and the answers cached under it (call after a profile update)."""
+        fingerprint = self.fingerprints.get(user_id)
+        self.fingerprints.invalidate(user_id)
+        if fingerprint is None:
+            return
+        stale = [key for key in self.answers.keys() if key[0] == fingerprint]
+        for key in stale:
+            self.answers.invalidate(key)
+        self.invalidations += len(stale)
+
+    def stats(self):
+        stats = self.answers.stats()
+        stats["invalidated"] = self.invalidations
+        stats["profiles"] = len(self.fingerprints)
+        return stats
+
+
+recommendation_cache = RecommendationCache(
+    maxsize=int(os.getenv("RECOMMENDATION_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("RECOMMENDATION_CACHE_TTL", "3600")),
+)
@@ -0,0 +1,376 @@
+"""
+Deadlines, hedged requests and circuit breaking for upstream calls.
+
+Deadlines
+    An endpoint opens a :func:`deadline` scope with its end-to-end budget. The
+    absolute deadline lives in a context variable, so it follows the request
+    into the tasks it spawns. Each upstream hop takes at most a ``share`` of
+    the time left as its timeout, e.g. an image upload may use 40% of what
+    remains and the search gets the rest. A hop that starts after the
+    deadline fails immediately with :class:`DeadlineExceeded`.
+
+Hedging
+    For idempotent GETs on the endpoints listed in ``HEDGE_ENDPOINTS``, a second
+    identical request is sent if the first has not answered within the
+    endpoint's recent p95 latency. The first response wins and the other
+    request is cancelled. A hedge is only sent when ``admit()`` allows it
+    (e.g. the rate governor has a token to spare right now).
+
+Circuit breaking
+    Every upstream has a :class:`CircuitBreaker`. After
+    ``CIRCUIT_FAILURE_THRESHOLD`` consecutive failures (transport errors,
+    timeouts and 5xx responses) it opens, and calls fail fast with
+    :class:`CircuitOpenError` for ``CIRCUIT_RESET_TIMEOUT`` seconds. Then a
+    single probe is let through: success closes the circuit, failure opens it
+    again. A timeout only counts as a failure when the upstream had its own
+    configured timeout; when the hop was cut short by the request's deadline
+    it counts as ``deadline_exceeded`` and leaves the breaker alone.
+
+``DeadlineExceeded`` and ``CircuitOpenError`` are ``httpx`` transport errors,
+so the existing ``except httpx.HTTPError`` handlers also cover them.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+import httpx
+
+from .http_client import UPSTREAMS
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+HEDGE_ENDPOINTS = {e.strip() for e in os.getenv("HEDGE_ENDPOINTS", "visual_search").split(",") if e.strip()}
+# Latency samples needed before hedging an endpoint
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = 200
+
+# Fraction of the remaining deadline the token and upload hops may use; the
+# search hop that follows gets whatever is left
+TOKEN_BUDGET_SHARE = float(os.getenv("TOKEN_BUDGET_SHARE", "0.25"))
+UPLOAD_BUDGET_SHARE = float(os.getenv("UPLOAD_BUDGET_SHARE", "0.4"))
+
+# Below this many seconds left, a hop is not worth starting
+MIN_HOP_TIMEOUT = 0.05
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(httpx.TimeoutException):
+    """The request's deadline passed before (or while) calling an upstream."""
+
+
+class CircuitOpenError(httpx.TransportError):
+    """The upstream's circuit is open: the call was not attempted."""
+
+
+@contextmanager
+def deadline(seconds, inherit=True):
+    """
+    Give the enclosed code at most ``seconds`` to finish.
+
+    Args:
+        seconds: Budget in seconds; None means no deadline of its own.
+        inherit: Keep an enclosing, earlier deadline. Pass False for work that
+            outlives the current request (prefetches, background refreshes).
+    """
+    current = _deadline.get() if inherit else None
+    if seconds is not None:
+        own = time.monotonic() + seconds
+        current = own if current is None else min(current, own)
+    token = _deadline.set(current)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def with_deadline(seconds):
+    """Decorator running an async endpoint inside ``deadline(seconds)``."""
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            with deadline(seconds):
+                return await endpoint(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def remaining():
+    """Seconds left before the current deadline, or None without a deadline."""
+    current = _deadline.get()
+    if current is None:
+        return None
+    return current - time.monotonic()
+
+
+def hop_timeout(share=1.0):
+    """
+    Timeout for the next upstream hop: ``share`` of the time left.
+
+    Returns:
+        float: Seconds, or None when there is no deadline.
+
+    Raises:
+        DeadlineExceeded: If the deadline has (almost) passed.
+    """
+    left = remaining()
+    if left is None:
+        return None
+    if left < MIN_HOP_TIMEOUT:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return max(left * share, MIN_HOP_TIMEOUT)
+
+
+class LatencyTracker:
+    """Recent latencies of one endpoint, for its p95."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def p95(self):
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker (closed → open → half-open)."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+        self.opened = 0
+        self.rejected = 0
+
+    def before_call(self, upstream):
+        """Raise :class:`CircuitOpenError` unless a call may go through now."""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                raise CircuitOpenError(f"Circuit open for {upstream}")
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                self.rejected += 1
+                raise CircuitOpenError(f"Circuit half-open for {upstream}, probe in progress")
+            self._probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self._probing = False
+        self.state = self.CLOSED
+
+    def record_failure(self):
+        self._probing = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """The call ended without a verdict (e.g. it was cancelled)."""
+        self._probing = False
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class UpstreamGuard:
+    """
+    Deadline, hedging and circuit breaker for the calls to one upstream.
+
+    Args:
+        name: Upstream name (as in ``http_client.UPSTREAMS``).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.breaker = CircuitBreaker()
+        self.latencies = {}
+
+        self.calls = 0
+        self.failures = 0
+        self.deadline_exceeded = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _budget_limited(self, timeout):
+        """Whether ``timeout`` is shorter than the upstream's own read timeout."""
+        return timeout is not None and timeout < UPSTREAMS[self.name]["read_timeout"]
+
+    def _record_error(self, error, budget_limited):
+        if budget_limited and isinstance(error, httpx.TimeoutException):
+            # The request ran out of budget; that says nothing about the upstream
+            self.deadline_exceeded += 1
+            self.breaker.release()
+        else:
+            self.failures += 1
+            self.breaker.record_failure()
+
+    def _tracker(self, endpoint):
+        tracker = self.latencies.get(endpoint)
+        if tracker is None:
+            tracker = self.latencies[endpoint] = LatencyTracker()
+        return tracker
+
+    async def call(self, send, endpoint="default", share=1.0, idempotent=False, admit=None):
+        """
+        Send one request to the upstream.
+
+        Args:
+            send: ``send(**kwargs)`` coroutine function performing the request;
+                the kwargs (``timeout``) must be passed on to httpx.
+            endpoint: Name of the endpoint, for latencies and hedging.
+            share: Fraction of the remaining deadline this hop may use.
+            idempotent: Whether the request may be sent twice (hedging).
+            admit: Optional ``admit()`` deciding whether a hedge may be sent.
+
+        Returns:
+            httpx.Response: The response (5xx responses are returned too, but
+            count as failures for the circuit breaker).
+        """
+        try:
+            timeout = hop_timeout(share)
+        except DeadlineExceeded:
+            self.deadline_exceeded += 1
+            raise
+        self.breaker.before_call(self.name)
+        kwargs = {} if timeout is None else {"timeout": timeout}
+        budget_limited = self._budget_limited(timeout)
+        self.calls += 1
+
+        tracker = self._tracker(endpoint)
+        started = time.monotonic()
+        try:
+            if idempotent and endpoint in HEDGE_ENDPOINTS:
+                response = await self._hedged(lambda: send(**kwargs), tracker, admit)
+            else:
+                response = await send(**kwargs)
+        except httpx.TransportError as e:
+            self._record_error(e, budget_limited)
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        tracker.record(time.monotonic() - started)
+
+        if response.status_code >= 500:
+            self.failures += 1
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    @asynccontextmanager
+    async def stream(self, client, method, url, **kwargs):
+        """
+        ``client.stream(method, url, **kwargs)`` behind the circuit breaker.
+
+        Without an explicit ``timeout`` the remaining deadline (if any) is used.
+        Errors while the body is being read count as failures too.
+        """
+        budget_limited = False
+        if "timeout" not in kwargs:
+            try:
+                timeout = hop_timeout()
+            except DeadlineExceeded:
+                self.deadline_exceeded += 1
+                raise
+            if timeout is not None:
+                kwargs["timeout"] = timeout
+            budget_limited = self._budget_limited(timeout)
+        self.breaker.before_call(self.name)
+        self.calls += 1
+        try:
+            async with client.stream(method, url, **kwargs) as response:
+                if response.status_code >= 500:
+                    self.failures += 1
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                yield response
+        except httpx.TransportError as e:
+            self._record_error(e, budget_limited)
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+
+    async def _hedged(self, send, tracker, admit):
+        delay = tracker.p95()
+        left = remaining()
+        if delay is None or (left is not None and delay >= left):
+            return await send()
+
+        attempts = [asyncio.ensure_future(send())]
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if done or (admit is not None and not admit()):
+                return await attempts[0]
+
+            self.hedges += 1
+            attempts.append(asyncio.ensure_future(send()))
+            pending = set(attempts)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        if attempt is attempts[1]:
+                            self.hedge_wins += 1
+                        return attempt.result()
+                    error = attempt.exception()
+            raise error
+        finally:
+            for attempt in attempts:
+                if not attempt.done():
+                    attempt.cancel()
+
+    def stats(self):
+        stats = {
+            "calls": self.calls,
+            "failures": self.failures,
+            "deadline_exceeded": self.deadline_exceeded,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "p95": {endpoint: tracker.p95() for endpoint, tracker in self.latencies.items()},
+        }
+        stats.update(self.breaker.stats())
+        return stats
+
+
+guards = {name: UpstreamGuard(name) for name in ("inditex", "freeimage", "agent")}
+
+
+def get_guard(upstream):
+    """Guard of ``upstream`` ("inditex", "freeimage" or "agent")."""
+    return guards[upstream]
+
+
+def stats():
+    return {name: guard.stats() for name, guard in guards.items()}
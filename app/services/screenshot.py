@@ -1,23 +1,211 @@
 from playwright.async_api import async_playwright
 import base64
+from contextlib import asynccontextmanager
 from typing import Optional
 import asyncio
+import os
+import time
 
-async def capture_screenshot(url: str) -> Optional[str]:
-    try:
-        print(f"Capturing screenshot for URL: {url}")  # Print the link
-        async with async_playwright() as p:
-            # Launch browser with specific args for container environment
-            browser = await p.chromium.launch(
+# Maximum number of pages rendering at the same time
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "4"))
+# A page (and its context) is closed and replaced after this many screenshots
+BROWSER_PAGE_MAX_USES = int(os.getenv("BROWSER_PAGE_MAX_USES", "50"))
+# Seconds a request may wait for a free page before giving up
+BROWSER_ACQUIRE_TIMEOUT = float(os.getenv("BROWSER_ACQUIRE_TIMEOUT", "30"))
+
+
+class _PooledPage:
+    __slots__ = ("context", "page", "uses", "broken")
+
+    def __init__(self, context, page):
+        self.context = context
+        self.page = page
+        self.uses = 0
+        self.broken = False
+
+
+class BrowserPool:
+    """
+    Long-lived Chromium instance with a bounded pool of reusable pages.
+
+    The browser is launched once (at application startup or on first use).
+    At most ``size`` pages render concurrently; further requests wait on a
+    semaphore. Each page has its own context and is recycled after
+    ``max_uses`` screenshots or as soon as it crashes, and the browser is
+    relaunched if it disconnects.
+    """
+
+    def __init__(self, size=BROWSER_POOL_SIZE, max_uses=BROWSER_PAGE_MAX_USES,
+                 acquire_timeout=BROWSER_ACQUIRE_TIMEOUT):
+        self.size = size
+        self.max_uses = max_uses
+        self.acquire_timeout = acquire_timeout
+        self._playwright = None
+        self._browser = None
+        self._idle = []
+        # Created lazily so they bind to the running event loop
+        self._semaphore = None
+        self._launch_lock = None
+
+        self.waiting = 0
+        self.in_use = 0
+        self.acquisitions = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.pages_created = 0
+        self.pages_recycled = 0
+        self.crashes = 0
+        self.launches = 0
+
+    async def start(self):
+        """Start Playwright and launch the browser."""
+        if self._launch_lock is None:
+            self._semaphore = asyncio.Semaphore(self.size)
+            self._launch_lock = asyncio.Lock()
+        await self._ensure_browser()
+
+    async def stop(self):
+        """Close every page, the browser and Playwright."""
+        idle, self._idle = self._idle, []
+        for slot in idle:
+            await self._close_slot(slot)
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception as e:
+                print(f"Error closing browser: {e}")
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    async def _ensure_browser(self):
+        async with self._launch_lock:
+            if self._browser is not None and self._browser.is_connected():
+                return self._browser
+            # The browser died: its pages are unusable
+            for slot in self._idle:
+                slot.broken = True
+            self._idle = []
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(
                 headless=True
             )
-            
-            # Create new context and page
-            context = await browser.new_context(
-                viewport={'width': 1280, 'height': 800}
-            )
-            page = await context.new_page()
-            
+            self._browser.on("disconnected", self._on_disconnected)
+            self.launches += 1
+            return self._browser
+
+    def _on_disconnected(self, browser):
+        if browser is self._browser:
+            print("Browser disconnected; it will be relaunched on the next request")
+            self.crashes += 1
+            self._browser = None
+            for slot in self._idle:
+                slot.broken = True
+            self._idle = []
+
+    async def _new_slot(self):
+        browser = await self._ensure_browser()
+        context = await browser.new_context(
+            viewport={'width': 1280, 'height': 800}
+        )
+        page = await context.new_page()
+        slot = _PooledPage(context, page)
+
+        def on_crash(_):
+            slot.broken = True
+            self.crashes += 1
+
+        page.on("crash", on_crash)
+        self.pages_created += 1
+        return slot
+
+    async def _close_slot(self, slot):
+        try:
+            await slot.context.close()
+        except Exception:
+            # The context is already gone if the browser crashed
+            pass
+
+    @asynccontextmanager
+    async def page(self):
+        """
+        Borrow a page from the pool.
+
+        Raises:
+            asyncio.TimeoutError: If no page became free within ``acquire_timeout``.
+        """
+        if self._launch_lock is None:
+            await self.start()
+
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - started
+        self.acquisitions += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+        slot = None
+        self.in_use += 1
+        try:
+            if self._browser is None or not self._browser.is_connected():
+                await self._ensure_browser()
+            slot = self._idle.pop() if self._idle else await self._new_slot()
+            yield slot.page
+        finally:
+            self.in_use -= 1
+            if slot is not None:
+                slot.uses += 1
+                await self._release(slot)
+            self._semaphore.release()
+
+    async def _release(self, slot):
+        if not slot.broken and slot.uses < self.max_uses and self._browser is not None:
+            try:
+                # Drop the previous page's DOM and media before the next use
+                await slot.page.goto("about:blank")
+                self._idle.append(slot)
+                return
+            except Exception:
+                pass
+        self.pages_recycled += 1
+        await self._close_slot(slot)
+
+    def stats(self):
+        return {
+            "running": self._browser is not None,
+            "size": self.size,
+            "in_use": self.in_use,
+            "idle": len(self._idle),
+            "queue_depth": self.waiting,
+            "acquisitions": self.acquisitions,
+            "timeouts": self.timeouts,
+            "avg_wait": round(self.total_wait / self.acquisitions, 4) if self.acquisitions else 0.0,
+            "max_wait": round(self.max_wait, 4),
+            "pages_created": self.pages_created,
+            "pages_recycled": self.pages_recycled,
+            "crashes": self.crashes,
+            "launches": self.launches,
+        }
+
+
+browser_pool = BrowserPool()
+
+
+async def capture_screenshot_bytes(url: str) -> Optional[bytes]:
+    """Render the first product image of ``url`` as JPEG bytes, or None on error."""
+    try:
+        print(f"Capturing screenshot for URL: {url}")  # Print the link
+        async with browser_pool.page() as page:
             # Navigate to URL with timeout
             await page.goto(url, wait_until='networkidle', timeout=30000)
             first_image = page.locator('.media-image_image').first
@@ -27,19 +215,19 @@ async def capture_screenshot(url: str) -> Optional[str]:
             await asyncio.sleep(1)
             
             # Take screenshot of the first image only
-            screenshot_bytes = await first_image.screenshot(
+            return await first_image.screenshot(
                 type='jpeg',
-                quality=80,
-                full_page=False
+                quality=80
             )
             
-            # Close browser
-            await browser.close()
-            
-            # Convert to base64
-            base64_image = base64.b64encode(screenshot_bytes).decode('utf-8')
-            return base64_image
-            
     except Exception as e:
         print(f"Screenshot error: {str(e)}")
-        return None 
\ No newline at end of file
+        return None
+
+
+async def capture_screenshot(url: str) -> Optional[str]:
+    """Same as :func:`capture_screenshot_bytes`, encoded as base64."""
+    screenshot_bytes = await capture_screenshot_bytes(url)
+    if screenshot_bytes is None:
+        return None
+    return base64.b64encode(screenshot_bytes).decode('utf-8')
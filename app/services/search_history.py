@@ -0,0 +1,154 @@
+"""
+Write-behind log of the searches users run.
+
+Every text and visual search is recorded in the ``search_history`` table:
+who searched (NULL for anonymous searches), the normalized query, the brand,
+how many results were returned, the latency and whether the answer came from
+the result caches. Endpoints decorated with :func:`log_search` build the
+record; the row is queued on ``search_history_writer`` and written with
+multi-row inserts off the request path, so a slow database never slows a
+search down (when the queue is full, rows are dropped and counted instead).
+
+Whether a search was a cache hit is reported by the search functions through
+:func:`note_cache_lookup`, which updates the record of the current request (a
+context variable, so lookups made in tasks spawned by the request count too).
+A search is a hit only if every lookup it made was.
+"""
+import contextvars
+import functools
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import text
+
+from ..database import AsyncSessionLocal
+from .write_behind import BatchWriter
+
+TEXT = "text"
+VISUAL = "visual"
+
+MAX_QUERY_LENGTH = 255
+
+INSERT_SEARCHES = text("""
+    INSERT INTO search_history
+        (user_id, search_query, brand, search_type, result_count, latency_ms, cache_hit, search_date)
+    VALUES
+        (:user_id, :search_query, :brand, :search_type, :result_count, :latency_ms, :cache_hit, :search_date)
+""")
+
+_record = contextvars.ContextVar("search_history_record", default=None)
+
+
+class SearchRecord:
+    """What the search functions report about the request being served."""
+
+    __slots__ = ("query", "cache_hit")
+
+    def __init__(self, query=None):
+        self.query = query
+        self.cache_hit = None
+
+
+def note_cache_lookup(hit):
+    """Report a result cache lookup made for the current search."""
+    record = _record.get()
+    if record is not None:
+        record.cache_hit = hit if record.cache_hit is None else (record.cache_hit and hit)
+
+
+def set_search_query(query):
+    """Override the query logged for the current search (e.g. an image digest)."""
+    record = _record.get()
+    if record is not None:
+        record.query = query
+
+
+def count_results(result):
+    """Number of products in an endpoint response, or None if it has no result list."""
+    if isinstance(result, dict):
+        result = result.get("results")
+    if isinstance(result, list):
+        return len(result)
+    return None
+
+
+def record_search(search_type, query, user_id=None, brand=None, result_count=None,
+                  latency_ms=None, cache_hit=None):
+    """Queue one search for the history table. Never blocks."""
+    if not query:
+        return False
+    return search_history_writer.submit({
+        "user_id": user_id,
+        "search_query": query[:MAX_QUERY_LENGTH],
+        "brand": (brand or "").strip().lower()[:100] or None,
+        "search_type": search_type,
+        "result_count": result_count,
+        "latency_ms": latency_ms,
+        "cache_hit": cache_hit,
+        # Time of the search, not of the (later) flush
+        "search_date": datetime.utcnow(),
+    })
+
+
+@contextmanager
+def tracking(query=None):
+    """Collect the :class:`SearchRecord` of the search run in the enclosed code."""
+    record = SearchRecord(query)
+    token = _record.set(record)
+    try:
+        yield record
+    finally:
+        _record.reset(token)
+
+
+def log_search(search_type, query_param="query", normalize=None):
+    """
+    Decorator recording every call of a search endpoint in the history.
+
+    The query is read from the endpoint's ``query_param`` argument (and passed
+    through ``normalize``), the brand from ``brand`` and the user from
+    ``current_user``. Failed searches are recorded with a NULL result count.
+    """
+    def decorator(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            query = kwargs.get(query_param)
+            if query is not None and normalize is not None:
+                query = normalize(query)
+            started = time.monotonic()
+            result = None
+            try:
+                with tracking(query) as record:
+                    result = await endpoint(*args, **kwargs)
+                return result
+            finally:
+                user = kwargs.get("current_user")
+                record_search(
+                    search_type,
+                    record.query,
+                    user_id=getattr(user, "user_id", None),
+                    brand=kwargs.get("brand"),
+                    result_count=count_results(result),
+                    latency_ms=int((time.monotonic() - started) * 1000),
+                    cache_hit=record.cache_hit,
+                )
+        return wrapper
+    return decorator
+
+
+async def _insert_searches(rows):
+    async with AsyncSessionLocal() as db:
+        # One executemany round trip for the whole batch
+        await db.execute(INSERT_SEARCHES, rows)
+        await db.commit()
+
+
+search_history_writer = BatchWriter(
+    "search_history",
+    _insert_searches,
+    max_batch=int(os.getenv("SEARCH_HISTORY_BATCH_SIZE", "500")),
+    interval=float(os.getenv("SEARCH_HISTORY_FLUSH_INTERVAL", "2.0")),
+    max_queue=int(os.getenv("SEARCH_HISTORY_QUEUE_SIZE", "10000")),
+)
@@ -0,0 +1,112 @@
+"""
+Request coalescing ("single flight") for upstream calls.
+
+Concurrent calls with the same key share one in-flight call: the first
+caller starts it, later callers attach to it, and all of them get its result
+or its exception. Each caller waits through ``asyncio.shield``, so a caller
+that is cancelled (e.g. the client disconnected) only detaches itself. The
+shared call is cancelled once every caller has gone.
+
+Only in-flight calls are shared; results are not kept after the call
+finishes (that is what the result caches are for).
+
+The shared call must not depend on which caller happened to start it:
+
+* calls are only shared between callers of the same rate governor priority
+  (the priority is part of the key), so an interactive request never waits
+  behind a prefetch that is throttled as such,
+* the shared call runs with its own ``SINGLEFLIGHT_DEADLINE`` instead of the
+  first caller's deadline, and each caller stops waiting (with
+  :class:`~app.services.resilience.DeadlineExceeded`) when its own deadline
+  passes.
+"""
+import asyncio
+import os
+
+from .rate_governor import current_priority
+from .resilience import DeadlineExceeded, deadline, remaining
+
+SINGLEFLIGHT_DEADLINE = float(os.getenv("SINGLEFLIGHT_DEADLINE", "30"))
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Group of coalesced calls.
+
+    Args:
+        name: Name used in the metrics.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+
+        self.calls = 0
+        self.coalesced = 0
+        self.cancelled = 0
+        self.deadline_exceeded = 0
+        self.max_waiters = 0
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, fn):
+        """
+        Return ``await fn()``, sharing the call with concurrent callers of ``key``.
+
+        Args:
+            key: Hashable identity of the request (normalize it first).
+            fn: Zero-argument coroutine function performing the call.
+        """
+        key = (current_priority(), key)
+        call = self._calls.get(key)
+        if call is None:
+            # Own deadline: the call outlives whichever caller started it
+            with deadline(SINGLEFLIGHT_DEADLINE, inherit=False):
+                call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _, call=call: self._forget(key, call))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        self.max_waiters = max(self.max_waiters, call.waiters)
+        try:
+            left = remaining()
+            if left is None:
+                return await asyncio.shield(call.task)
+            try:
+                return await asyncio.wait_for(asyncio.shield(call.task), max(left, 0))
+            except asyncio.TimeoutError:
+                self.deadline_exceeded += 1
+                raise DeadlineExceeded("Request deadline exceeded waiting for a shared call")
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Every caller is gone: nobody needs the result any more
+                call.task.cancel()
+                self._forget(key, call)
+                self.cancelled += 1
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self):
+        return {
+            "inflight": len(self._calls),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+            "deadline_exceeded": self.deadline_exceeded,
+            "max_waiters": self.max_waiters,
+        }
@@ -0,0 +1,245 @@
+"""
+Typeahead suggestions for the search box.
+
+Suggestions come from two sources: the text queries users searched (from
+``search_history``, only searches that returned results) and the names of the
+products we have seen (from ``products``). Each suggestion is scored by
+popularity: one point per search, ``SUGGEST_PRODUCT_WEIGHT`` per product with
+that name.
+
+The index is a sorted list of keys with bisect lookups. Keys are
+accent-folded and a suggestion is indexed at the start of each of its words,
+so "dres" finds "red dress". Suggestions are numbered by descending score,
+so the best ``k`` matches of a prefix are the ``k`` smallest numbers in its
+key range. The top suggestions of every one- and two-character prefix
+(where ranges are largest) are precomputed.
+
+A background task refreshes the index every ``SUGGEST_REFRESH_INTERVAL``
+seconds. It reads only the searches and products added since the previous
+refresh, merges them into the running counts and, if anything changed,
+rebuilds the index in a worker thread and swaps it in. The cursors are high-water
+marks, so rows committed out of order (a lower ``search_id`` or ``first_seen``
+becoming visible after a higher one) are missed; every
+``SUGGEST_FULL_REBUILD_INTERVAL`` seconds the counts are therefore recomputed
+from scratch.
+"""
+import asyncio
+import bisect
+import os
+import time
+import unicodedata
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import text
+
+from ..database import AsyncSessionLocal
+
+SUGGEST_REFRESH_INTERVAL = float(os.getenv("SUGGEST_REFRESH_INTERVAL", "60"))
+SUGGEST_MAX_TERMS = int(os.getenv("SUGGEST_MAX_TERMS", "50000"))
+SUGGEST_PRODUCT_WEIGHT = float(os.getenv("SUGGEST_PRODUCT_WEIGHT", "0.2"))
+SUGGEST_FULL_REBUILD_INTERVAL = float(os.getenv("SUGGEST_FULL_REBUILD_INTERVAL", "3600"))
+MAX_SUGGESTIONS = 20
+# Prefixes up to this length have their top suggestions precomputed
+PRECOMPUTED_PREFIX_LENGTH = 2
+MAX_SUGGESTION_LENGTH = 100
+
+NEW_SEARCHES = text("""
+    SELECT search_query, COUNT(*) AS searches, MAX(search_id) AS last_id
+    FROM search_history
+    WHERE search_id > :after AND search_type = 'text' AND result_count > 0
+    GROUP BY search_query
+""")
+
+NEW_PRODUCTS = text("""
+    SELECT LOWER(name) AS name, COUNT(*) AS products, MAX(first_seen) AS last_seen
+    FROM products
+    WHERE first_seen > :since
+    GROUP BY LOWER(name)
+""")
+
+
+def normalize_suggestion(value):
+    """Lowercase ``value`` and collapse whitespace."""
+    return " ".join((value or "").lower().split())[:MAX_SUGGESTION_LENGTH]
+
+
+def fold(value):
+    """Accent-free form of a normalized string, used as index key."""
+    decomposed = unicodedata.normalize("NFKD", value)
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+class PrefixIndex:
+    """
+    Immutable prefix index over scored suggestions.
+
+    Args:
+        scores: Mapping of suggestion text to popularity score.
+        max_terms: Only the ``max_terms`` most popular suggestions are indexed.
+    """
+
+    def __init__(self, scores, max_terms=SUGGEST_MAX_TERMS):
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:max_terms]
+        self.texts = [suggestion for suggestion, _ in ranked]
+
+        entries = []
+        for number, suggestion in enumerate(self.texts):
+            key = fold(suggestion)
+            start = 0
+            while start < len(key):
+                entries.append((key[start:], number))
+                start = key.find(" ", start)
+                if start < 0:
+                    break
+                start += 1
+        entries.sort()
+        self.keys = [key for key, _ in entries]
+        self.numbers = np.fromiter((number for _, number in entries), dtype=np.int32, count=len(entries))
+
+        # Short prefixes match large ranges: keep their answer ready
+        self.top = {}
+        for key, number in sorted(entries, key=lambda entry: entry[1]):
+            for length in range(1, min(len(key), PRECOMPUTED_PREFIX_LENGTH) + 1):
+                best = self.top.setdefault(key[:length], [])
+                if len(best) < MAX_SUGGESTIONS and number not in best:
+                    best.append(number)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def lookup(self, prefix, limit=10):
+        """The ``limit`` most popular suggestions starting (at a word) with ``prefix``."""
+        key = fold(normalize_suggestion(prefix))
+        if not key:
+            return []
+        limit = min(limit, MAX_SUGGESTIONS)
+        if len(key) <= PRECOMPUTED_PREFIX_LENGTH:
+            numbers = self.top.get(key, [])[:limit]
+        else:
+            lo = bisect.bisect_left(self.keys, key)
+            hi = bisect.bisect_left(self.keys, key + "\uffff", lo)
+            # Sorted unique numbers: the most popular come first
+            numbers = np.unique(self.numbers[lo:hi])[:limit].tolist()
+        return [self.texts[number] for number in numbers]
+
+
+class SuggestionIndexer:
+    """
+    Keeps a :class:`PrefixIndex` up to date in the background.
+
+    Args:
+        interval: Seconds between two refreshes.
+        max_terms: Suggestions kept in the index.
+        product_weight: Score of one product name relative to one search.
+        full_rebuild_interval: Seconds between two recounts from scratch.
+    """
+
+    def __init__(self, interval=SUGGEST_REFRESH_INTERVAL, max_terms=SUGGEST_MAX_TERMS,
+                 product_weight=SUGGEST_PRODUCT_WEIGHT, full_rebuild_interval=SUGGEST_FULL_REBUILD_INTERVAL):
+        self.interval = interval
+        self.max_terms = max_terms
+        self.product_weight = product_weight
+        self.full_rebuild_interval = full_rebuild_interval
+        self.index = PrefixIndex({})
+        self._scores = Counter()
+        # Refresh cursors: last search_history row and product first_seen read
+        self._last_search_id = 0
+        self._last_product_seen = None
+        self._last_full_load = None
+        self._task = None
+
+        self.builds = 0
+        self.full_loads = 0
+        self.refresh_errors = 0
+        self.last_build_duration = 0.0
+        self.lookups = 0
+        self.lookup_time = 0.0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.refresh_errors += 1
+                print(f"Error refreshing search suggestions: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def _load_increment(self, last_search_id, last_product_seen):
+        """Counts of the rows after the given cursors, and the advanced cursors."""
+        changes = Counter()
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(NEW_SEARCHES, {"after": last_search_id})).mappings().all()
+            for row in rows:
+                changes[normalize_suggestion(row["search_query"])] += row["searches"]
+                last_search_id = max(last_search_id, row["last_id"])
+
+            since = last_product_seen or datetime.min
+            rows = (await db.execute(NEW_PRODUCTS, {"since": since})).mappings().all()
+            for row in rows:
+                changes[normalize_suggestion(row["name"])] += row["products"] * self.product_weight
+                if last_product_seen is None or row["last_seen"] > last_product_seen:
+                    last_product_seen = row["last_seen"]
+        changes.pop("", None)
+        return changes, last_search_id, last_product_seen
+
+    async def refresh(self):
+        """Read what changed since the last refresh and rebuild the index if needed."""
+        now = time.monotonic()
+        if self._last_full_load is None or now - self._last_full_load >= self.full_rebuild_interval:
+            # Recount everything: picks up rows the cursors skipped
+            changes, self._last_search_id, self._last_product_seen = await self._load_increment(0, None)
+            self._scores = changes
+            self._last_full_load = now
+            self.full_loads += 1
+        else:
+            changes, self._last_search_id, self._last_product_seen = await self._load_increment(
+                self._last_search_id, self._last_product_seen)
+            if not changes and self.builds:
+                return
+            self._scores.update(changes)
+        if len(self._scores) > 2 * self.max_terms:
+            # Forget the long tail so the counts do not grow without bound
+            self._scores = Counter(dict(self._scores.most_common(self.max_terms)))
+
+        started = time.monotonic()
+        self.index = await asyncio.to_thread(PrefixIndex, dict(self._scores), self.max_terms)
+        self.last_build_duration = time.monotonic() - started
+        self.builds += 1
+
+    def lookup(self, prefix, limit=10):
+        started = time.perf_counter()
+        suggestions = self.index.lookup(prefix, limit)
+        self.lookup_time += time.perf_counter() - started
+        self.lookups += 1
+        return suggestions
+
+    async def stop(self):
+        """Stop refreshing (called on shutdown)."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "suggestions": len(self.index),
+            "keys": len(self.index.keys),
+            "builds": self.builds,
+            "full_loads": self.full_loads,
+            "refresh_errors": self.refresh_errors,
+            "last_build_duration": round(self.last_build_duration, 4),
+            "lookups": self.lookups,
+            "avg_lookup_us": round(self.lookup_time / self.lookups * 1e6, 1) if self.lookups else 0.0,
+        }
+
+
+suggestion_indexer = SuggestionIndexer()
@@ -0,0 +1,178 @@
+"""
+Content-addressed cache for visual search results.
+
+Uploaded images are identified by the SHA-256 of their bytes and by a 64-bit
+perceptual difference hash (dHash). An exact match or a perceptual match
+within ``max_distance`` bits (re-encoded, resized or slightly recompressed
+copies of the same picture) resolves to the same cache entry, so repeated
+searches skip both the image upload and the Inditex call.
+"""
+import asyncio
+import hashlib
+import io
+import os
+from collections import OrderedDict
+
+from PIL import Image
+
+from .cache import TTLCache
+
+# 64-bit hashes split into 8 bands of 8 bits: two hashes within 7 bits of each
+# other always share at least one band, so only same-band hashes are compared.
+_BANDS = 8
+_BAND_BITS = 64 // _BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+
+class ImageFingerprint:
+    __slots__ = ("sha256", "phash")
+
+    def __init__(self, sha256, phash):
+        self.sha256 = sha256
+        self.phash = phash
+
+
+def dhash(image, size=8):
+    """
+    Difference hash of a PIL image: compares horizontally adjacent pixels of a
+    ``(size + 1) x size`` grayscale thumbnail.
+    """
+    gray = image.convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = list(gray.getdata())
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def fingerprint_image(content):
+    """
+    Compute the :class:`ImageFingerprint` of raw image bytes.
+
+    ``phash`` is None when the bytes cannot be decoded as an image.
+    """
+    sha256 = hashlib.sha256(content).hexdigest()
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            # Let the JPEG decoder downscale while decoding; we only need a thumbnail
+            image.draft("L", (64, 64))
+            phash = dhash(image)
+    except Exception as e:
+        print(f"Could not compute perceptual hash: {e}")
+        phash = None
+    return ImageFingerprint(sha256, phash)
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class VisualSearchCache:
+    """
+    Visual search results keyed by image content.
+
+    Args:
+        maxsize: Maximum number of cached result pages.
+        ttl: Seconds a cached result page is served.
+        max_distance: Maximum Hamming distance between perceptual hashes for
+            two images to be considered the same (at most 7).
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, max_distance=5):
+        self.results = TTLCache("visual_search", maxsize=maxsize, ttl=ttl)
+        self.max_distance = min(max_distance, _BANDS - 1)
+        self.max_images = maxsize
+        # sha256 -> (canonical sha256, phash), in LRU order
+        self._images = OrderedDict()
+        # (band number, band value) -> set of canonical sha256
+        self._bands = {}
+
+        self.exact_matches = 0
+        self.perceptual_matches = 0
+
+    async def fingerprint(self, content):
+        """Fingerprint ``content`` in a worker thread (image decoding is CPU bound)."""
+        return await asyncio.to_thread(fingerprint_image, content)
+
+    def get(self, fingerprint, page, per_page):
+        """Return the cached results for the image, or None."""
+        canonical = self._resolve(fingerprint)
+        if canonical is None:
+            self.results.misses += 1
+            return None
+        return self.results.get((canonical, int(page), int(per_page)))
+
+    def is_fresh(self, fingerprint, page, per_page):
+        """Whether results for the image are cached (not counted in the metrics)."""
+        canonical = self._resolve(fingerprint, record=False)
+        if canonical is None:
+            return False
+        return self.results.is_fresh((canonical, int(page), int(per_page)))
+
+    def set(self, fingerprint, page, per_page, results):
+        canonical = self._resolve(fingerprint, record=False) or fingerprint.sha256
+        self._remember(fingerprint, canonical)
+        self.results.set((canonical, int(page), int(per_page)), results)
+
+    def _resolve(self, fingerprint, record=True):
+        """Map an image to the canonical digest of a previously seen, matching image."""
+        known = self._images.get(fingerprint.sha256)
+        if known is not None:
+            self._images.move_to_end(fingerprint.sha256)
+            if record:
+                self.exact_matches += 1
+            return known[0]
+
+        if fingerprint.phash is None:
+            return None
+        best, best_distance = None, self.max_distance + 1
+        for band in self._iter_bands(fingerprint.phash):
+            for candidate in self._bands.get(band, ()):
+                distance = hamming_distance(fingerprint.phash, self._images[candidate][1])
+                if distance < best_distance:
+                    best, best_distance = candidate, distance
+        if best is not None:
+            # Remember the exact digest too so the next lookup is a dict hit
+            self._remember(fingerprint, best)
+            if record:
+                self.perceptual_matches += 1
+        return best
+
+    def _remember(self, fingerprint, canonical):
+        self._images[fingerprint.sha256] = (canonical, fingerprint.phash)
+        self._images.move_to_end(fingerprint.sha256)
+        if fingerprint.sha256 == canonical and fingerprint.phash is not None:
+            for band in self._iter_bands(fingerprint.phash):
+                self._bands.setdefault(band, set()).add(canonical)
+        while len(self._images) > self.max_images:
+            sha256, (_, phash) = self._images.popitem(last=False)
+            if phash is not None:
+                for band in self._iter_bands(phash):
+                    members = self._bands.get(band)
+                    if members is not None:
+                        members.discard(sha256)
+                        if not members:
+                            del self._bands[band]
+
+    @staticmethod
+    def _iter_bands(phash):
+        for i in range(_BANDS):
+            yield i, (phash >> (i * _BAND_BITS)) & _BAND_MASK
+
+    def stats(self):
+        stats = self.results.stats()
+        stats.update({
+            "images": len(self._images),
+            "exact_matches": self.exact_matches,
+            "perceptual_matches": self.perceptual_matches,
+        })
+        return stats
+
+
+visual_cache = VisualSearchCache(
+    maxsize=int(os.getenv("VISUAL_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("VISUAL_CACHE_TTL", "3600")),
+    max_distance=int(os.getenv("VISUAL_CACHE_MAX_DISTANCE", "5")),
+)
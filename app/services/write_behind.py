@@ -0,0 +1,116 @@
+"""
+Write-behind batching for non-critical database writes.
+
+Request handlers call ``BatchWriter.submit`` which only appends to a bounded
+in-memory queue. A background task drains the queue and hands the rows to
+``flush`` in batches of up to ``max_batch`` rows, at least every
+``interval`` seconds. When the database is slow and the queue is full, new
+rows are dropped (and counted) instead of slowing requests down.
+"""
+import asyncio
+import time
+
+
+class BatchWriter:
+    """
+    Args:
+        name: Name used in logs and metrics.
+        flush: ``async def flush(rows)`` that writes a list of rows.
+        max_batch: Maximum number of rows per ``flush`` call.
+        interval: Maximum seconds a row waits in the queue.
+        max_queue: Queue capacity; rows submitted beyond it are dropped.
+    """
+
+    def __init__(self, name, flush, max_batch=500, interval=0.5, max_queue=10000):
+        self.name = name
+        self._flush = flush
+        self.max_batch = max_batch
+        self.interval = interval
+        self.max_queue = max_queue
+        # Created in start() so they bind to the running event loop
+        self._queue = None
+        self._task = None
+
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_flush_duration = 0.0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            if self._queue is None:
+                self._queue = asyncio.Queue(self.max_queue)
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Stop the background task and flush whatever is still queued."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._queue is not None:
+            while not self._queue.empty():
+                await self._write(self._drain())
+
+    def submit(self, row):
+        """Queue ``row`` for writing. Never blocks; returns False if dropped."""
+        self.start()
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        return True
+
+    def _drain(self, limit=None):
+        limit = self.max_batch if limit is None else limit
+        rows = []
+        while len(rows) < limit and not self._queue.empty():
+            rows.append(self._queue.get_nowait())
+        return rows
+
+    async def _run(self):
+        while True:
+            rows = [await self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            # Wait for the batch to fill up, but never longer than the interval
+            while len(rows) < self.max_batch:
+                rows.extend(self._drain(self.max_batch - len(rows)))
+                remaining = deadline - time.monotonic()
+                if len(rows) >= self.max_batch or remaining <= 0:
+                    break
+                try:
+                    rows.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._write(rows)
+
+    async def _write(self, rows):
+        if not rows:
+            return
+        started = time.monotonic()
+        try:
+            await self._flush(rows)
+            self.written += len(rows)
+        except Exception as e:
+            self.failed += len(rows)
+            print(f"Error flushing {len(rows)} {self.name} rows: {e}")
+        self.batches += 1
+        self.last_flush_duration = time.monotonic() - started
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "submitted": self.submitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_flush_duration": round(self.last_flush_duration, 4),
+        }
@@ -118,6 +118,46 @@ function setupSearchToggle() {
     });
 }
 
+// Typeahead: offer popular queries while the user types
+function setupSuggestions() {
+    const input = document.getElementById('searchQuery');
+    const list = document.createElement('datalist');
+    list.id = 'searchSuggestions';
+    input.after(list);
+    input.setAttribute('list', list.id);
+    input.setAttribute('autocomplete', 'off');
+
+    let timeout;
+    let controller;
+    input.addEventListener('input', () => {
+        clearTimeout(timeout);
+        const prefix = input.value.trim();
+        if (!prefix) {
+            list.innerHTML = '';
+            return;
+        }
+        timeout = setTimeout(async () => {
+            // Only the answer to the latest keystroke matters
+            if (controller) controller.abort();
+            controller = new AbortController();
+            try {
+                const params = new URLSearchParams({ prefix, limit: 8 });
+                const response = await fetch(`${API_BASE_URL}/search/suggest?${params}`, { signal: controller.signal });
+                if (!response.ok) return;
+                const data = await response.json();
+                list.innerHTML = '';
+                data.suggestions.forEach(suggestion => {
+                    const option = document.createElement('option');
+                    option.value = suggestion;
+                    list.appendChild(option);
+                });
+            } catch (error) {
+                if (error.name !== 'AbortError') console.error('Suggestion error:', error);
+            }
+        }, 150);
+    });
+}
+
 // Show loading state
 function showLoading() {
     const resultsContainer = document.getElementById('results');
@@ -479,6 +519,7 @@ function initializeSelection(canvas) {
 document.addEventListener('DOMContentLoaded', () => {
     generateIcons();
     setupSearchToggle();
+    setupSuggestions();
     checkAuth();
 
     document.getElementById('searchButton').addEventListener('click', handleTextSearch);
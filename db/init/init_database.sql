@@ -21,10 +21,17 @@ CREATE TABLE IF NOT EXISTS users (
 );
 
 -- Search history table
+-- Written in batches by the search history writer; user_id is NULL for anonymous
+-- searches, search_query holds the normalized query (or the image URL/digest)
 CREATE TABLE IF NOT EXISTS search_history (
     search_id SERIAL PRIMARY KEY,
-    user_id INTEGER NOT NULL,
+    user_id INTEGER,
     search_query VARCHAR(255) NOT NULL,
+    brand VARCHAR(100),
+    search_type VARCHAR(10) NOT NULL DEFAULT 'text',
+    result_count INTEGER,
+    latency_ms INTEGER,
+    cache_hit BOOLEAN,
     search_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
 );
@@ -51,7 +58,29 @@ CREATE TABLE IF NOT EXISTS closet (
     FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
 );
 
+-- Local product catalog, filled from Inditex search responses
+CREATE TABLE IF NOT EXISTS products (
+    product_id VARCHAR(64) PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    brand VARCHAR(50),
+    price_currency VARCHAR(3),
+    price_current DECIMAL(10,2),
+    price_original DECIMAL(10,2),
+    link TEXT,
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(brand, '')), 'B')
+    ) STORED,
+    first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Add indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_search_history_user ON search_history(user_id);
-CREATE INDEX IF NOT EXISTS idx_wishlist_user ON wishlist(user_id);
-CREATE INDEX IF NOT EXISTS idx_closet_user ON closet(user_id); 
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_search_history_date ON search_history(search_date);
+-- Composite indexes serve both per-user lookups and keyset pagination (newest first)
+CREATE INDEX IF NOT EXISTS idx_wishlist_user_added ON wishlist(user_id, added_date DESC, wishlist_id DESC);
+CREATE INDEX IF NOT EXISTS idx_closet_user_added ON closet(user_id, added_date DESC, closet_id DESC);
+CREATE INDEX IF NOT EXISTS idx_products_search ON products USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_products_brand ON products(brand);
+CREATE INDEX IF NOT EXISTS idx_products_first_seen ON products(first_seen);
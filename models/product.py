@@ -1,8 +1,16 @@
+from urllib.parse import urlsplit
+
+import numpy as np
+
+
 class Product:
     """
     Clase para representar un producto con sus atributos.
     """
 
+    # Sin __dict__ por instancia: menos memoria y acceso a atributos más rápido
+    __slots__ = ("id", "name", "price_currency", "price_current", "price_original", "link", "brand")
+
     def __init__(self, product_id=None, name=None, price_currency=None, price_current=None, price_original=None, link=None, brand=None):
         """
         Inicializa una instancia de Product.
@@ -99,4 +107,229 @@ class Product:
           },
           "link": self.link,
           "brand": self.brand,
-      }
\ No newline at end of file
+      }
+
+
+def canonical_link(link):
+    """
+    Forma canónica de la URL de un producto: sin esquema, query ni fragmento,
+    host en minúsculas y sin barra final. Las distintas marcas y búsquedas
+    devuelven el mismo producto con parámetros de seguimiento diferentes.
+    """
+    if not link:
+        return link
+    parts = urlsplit(str(link).strip())
+    return f"{parts.netloc.lower()}{parts.path.rstrip('/')}"
+
+
+def _object_array(values):
+    """Array 1-D de objetos (evita que NumPy intente crear arrays anidados)."""
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _to_price(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _price_array(values):
+    """Array de precios float64; None y los valores no numéricos quedan como NaN."""
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.fromiter((_to_price(v) for v in values), dtype=np.float64, count=len(values))
+
+
+class ProductBatch:
+    """
+    Lote de productos en formato columnar.
+
+    Cada atributo es un array de NumPy con una posición por producto: los
+    textos (ids, nombres, marcas, monedas, enlaces) como arrays de objetos y
+    los precios como ``float64`` (``NaN`` si no hay precio). Filtrar, ordenar
+    o eliminar duplicados opera sobre índices y no crea un diccionario por
+    producto; los diccionarios sólo se generan al serializar con
+    :meth:`to_list`.
+    """
+
+    __slots__ = ("ids", "names", "brands", "currencies", "links", "price_current", "price_original")
+
+    def __init__(self, ids, names, brands, currencies, links, price_current, price_original):
+        self.ids = ids
+        self.names = names
+        self.brands = brands
+        self.currencies = currencies
+        self.links = links
+        self.price_current = price_current
+        self.price_original = price_original
+
+    @classmethod
+    def empty(cls):
+        return cls.from_inditex([])
+
+    @classmethod
+    def from_inditex(cls, results, brand=None):
+        """
+        Construye un lote a partir de una página de la API de Inditex en una
+        sola pasada.
+
+        Args:
+            results (list): Lista de productos tal y como los devuelve la API.
+            brand (str, optional): Marca a usar si un producto no la incluye.
+
+        Returns:
+            ProductBatch: El lote (los elementos que no son diccionarios se ignoran).
+        """
+        ids, names, brands, currencies, links, current, original = [], [], [], [], [], [], []
+        for product_dict in results or ():
+            if not isinstance(product_dict, dict):
+                continue
+            price_data = product_dict.get('price') or {}
+            value_data = price_data.get('value') or {}
+            ids.append(product_dict.get('id'))
+            names.append(product_dict.get('name'))
+            brands.append(product_dict.get('brand') or brand)
+            currencies.append(price_data.get('currency'))
+            links.append(product_dict.get('link'))
+            current.append(value_data.get('current'))
+            original.append(value_data.get('original'))
+
+        return cls.from_columns(ids, names, brands, currencies, links, current, original)
+
+    @classmethod
+    def from_columns(cls, ids, names, brands, currencies, links, price_current, price_original):
+        """
+        Construye un lote a partir de listas paralelas (una por atributo).
+
+        Los precios pueden contener None o valores no numéricos, que se
+        guardan como NaN.
+        """
+        return cls(
+            _object_array(ids),
+            _object_array(names),
+            _object_array(brands),
+            _object_array(currencies),
+            _object_array(links),
+            _price_array(price_current),
+            _price_array(price_original),
+        )
+
+    @classmethod
+    def concat(cls, batches):
+        """Une varios lotes en uno, conservando el orden."""
+        batches = list(batches)
+        if not batches:
+            return cls.empty()
+        return cls(*(np.concatenate([getattr(batch, name) for batch in batches]) for name in cls.__slots__))
+
+    @classmethod
+    def interleave(cls, batches):
+        """
+        Une varios lotes alternándolos: el primero de cada lote, luego el
+        segundo de cada lote, etc. Ningún lote acapara las primeras posiciones.
+        """
+        batches = [batch for batch in batches if len(batch)]
+        if not batches:
+            return cls.empty()
+        merged = cls.concat(batches)
+        positions = np.concatenate([np.arange(len(batch)) for batch in batches])
+        sources = np.concatenate([np.full(len(batch), i) for i, batch in enumerate(batches)])
+        # lexsort ordena por la última clave primero
+        return merged.take(np.lexsort((sources, positions)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        """Itera sobre el lote como objetos :class:`Product`."""
+        for i in range(len(self)):
+            yield self.product(i)
+
+    def product(self, i):
+        return Product(
+            product_id=self.ids[i],
+            name=self.names[i],
+            price_currency=self.currencies[i],
+            price_current=None if np.isnan(self.price_current[i]) else float(self.price_current[i]),
+            price_original=None if np.isnan(self.price_original[i]) else float(self.price_original[i]),
+            link=self.links[i],
+            brand=self.brands[i],
+        )
+
+    def take(self, indices):
+        """Nuevo lote con los productos en las posiciones ``indices`` (en ese orden)."""
+        indices = np.asarray(indices, dtype=np.intp)
+        return ProductBatch(*(getattr(self, name)[indices] for name in self.__slots__))
+
+    def filter(self, mask):
+        """Nuevo lote con los productos donde ``mask`` (array booleano) es True."""
+        return self.take(np.flatnonzero(mask))
+
+    def price_between(self, min_price=None, max_price=None):
+        """Máscara de los productos cuyo precio actual está en ``[min_price, max_price]``."""
+        mask = ~np.isnan(self.price_current)
+        if min_price is not None:
+            mask &= self.price_current >= min_price
+        if max_price is not None:
+            mask &= self.price_current <= max_price
+        return mask
+
+    def sort_by(self, column="price_current", descending=False):
+        """
+        Ordena por una columna de precio o por un array de puntuaciones.
+
+        Args:
+            column: Nombre de la columna (``price_current`` o ``price_original``)
+                o un array numérico con un valor por producto.
+            descending: Orden descendente. Los NaN quedan siempre al final.
+        """
+        values = getattr(self, column) if isinstance(column, str) else np.asarray(column, dtype=np.float64)
+        keys = -values if descending else values
+        # Orden estable; NaN se ordena al final con argsort
+        return self.take(np.argsort(keys, kind="stable"))
+
+    def dedupe_keys(self):
+        """Clave de identidad de cada producto: su id o, si no tiene, su enlace canónico."""
+        return _object_array([
+            f"id:{product_id}" if product_id is not None else f"link:{canonical_link(link)}"
+            for product_id, link in zip(self.ids, self.links)
+        ])
+
+    def dedupe(self):
+        """Elimina duplicados (mismo id o enlace) conservando la primera aparición."""
+        if len(self) == 0:
+            return self
+        _, first = np.unique(self.dedupe_keys().astype(str), return_index=True)
+        return self.take(np.sort(first))
+
+    def to_list(self):
+        """
+        Serializa el lote con la misma estructura que la API de Inditex.
+        """
+        current = self.price_current.tolist()
+        original = self.price_original.tolist()
+        return [
+            {
+                "id": product_id,
+                "name": name,
+                "price": {
+                    "currency": currency,
+                    "value": {
+                        # NaN != NaN: precio ausente
+                        "current": cur if cur == cur else None,
+                        "original": orig if orig == orig else None,
+                    },
+                },
+                "link": link,
+                "brand": brand,
+            }
+            for product_id, name, brand, currency, link, cur, orig in zip(
+                self.ids.tolist(), self.names.tolist(), self.brands.tolist(),
+                self.currencies.tolist(), self.links.tolist(), current, original
+            )
+        ]
+
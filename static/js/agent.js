@@ -1,3 +1,32 @@
+        // Aborts the stream of the previous question (closing it cancels the agent run)
+        let currentStream = null;
+
+        function formatAgentMessage(message) {
+            // Simple formatting of the message
+            return message
+                .replace(/\\\\/g, '')  // Remove double backslashes
+                .replace(/\\n/g, '<br>') // Convert \n to line breaks
+                .replace(/\\/g, '')  // Remove remaining backslashes
+                .replace(/\n/g, '<br>');
+        }
+
+        // Parse a Server-Sent Events block ("event: x\ndata: {...}") into {event, data}
+        function parseSseEvent(block) {
+            let event = 'message';
+            const dataLines = [];
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) dataLines.push(line.slice(5).replace(/^ /, ''));
+            });
+            if (!dataLines.length) return null;
+            const raw = dataLines.join('\n');
+            try {
+                return { event, data: JSON.parse(raw) };
+            } catch (e) {
+                return { event, data: raw };
+            }
+        }
+
         async function getRecommendations() {
             const queryInput = document.getElementById('queryInput');
             const loading = document.getElementById('loading');
@@ -10,21 +39,41 @@
                 return;
             }
 
+            if (currentStream) currentStream.abort();
+            const controller = new AbortController();
+            currentStream = controller;
+
             // Show loading state and clear previous results
             loading.classList.remove('hidden');
             recommendations.classList.add('hidden');
             recommendations.innerHTML = '';
             askButton.disabled = true;
             askButton.classList.add('opacity-50');
-            
+
+            const container = document.createElement('div');
+            container.className = 'space-y-2 text-left';
+            const status = document.createElement('div');
+            status.className = 'text-sm text-gray-500';
+            const output = document.createElement('div');
+            container.appendChild(status);
+            container.appendChild(output);
+            let text = '';
+
+            const showOutput = () => {
+                loading.classList.add('hidden');
+                recommendations.classList.remove('hidden');
+                if (!container.parentNode) recommendations.appendChild(container);
+            };
+
             try {
-                console.log('Sending request for:', query); // Debug log
                 const response = await fetch(
-                    `/agent/clothing-recommendations/?query=${encodeURIComponent(query)}`,
+                    `/agent/clothing-recommendations/stream?query=${encodeURIComponent(query)}`,
                     {
                         headers: {
-                            'Authorization': `Bearer ${localStorage.getItem('authToken')}`
-                        }
+                            'Authorization': `Bearer ${localStorage.getItem('authToken')}`,
+                            'Accept': 'text/event-stream'
+                        },
+                        signal: controller.signal
                     }
                 );
 
@@ -38,28 +87,45 @@
                     throw new Error(errorData.detail || 'Failed to get recommendations');
                 }
 
-                const data = await response.json();
-                console.log('Received response:', data); // Debug log
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true }).replace(/\r\n/g, '\n');
 
-                if (data.status === 'error') {
-                    throw new Error(data.message);
+                    let boundary;
+                    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                        const parsed = parseSseEvent(buffer.slice(0, boundary));
+                        buffer = buffer.slice(boundary + 2);
+                        if (!parsed) continue;
+                        const { event, data } = parsed;
+
+                        if (event === 'token') {
+                            text += typeof data === 'string' ? data : (data.text || '');
+                            showOutput();
+                            output.innerHTML = formatAgentMessage(text);
+                        } else if (event === 'tool') {
+                            showOutput();
+                            status.textContent = typeof data === 'string' ? data : (data.message || `Using ${data.tool || 'a tool'}...`);
+                        } else if (event === 'message') {
+                            if (data.status === 'error') throw new Error(data.message);
+                            if (data.message) text = data.message;
+                            showOutput();
+                            output.innerHTML = formatAgentMessage(text);
+                        } else if (event === 'error') {
+                            throw new Error(data.message || 'An error occurred while getting recommendations');
+                        } else if (event === 'done') {
+                            status.textContent = '';
+                        }
+                    }
                 }
 
-                recommendations.classList.remove('hidden');
-                if (data.message) {
-                    // Simple formatting of the message
-                    const formattedMessage = data.message
-                        .replace(/\\\\/g, '')  // Remove double backslashes
-                        .replace(/\\n/g, '<br>') // Convert \n to line breaks
-                        .replace(/\\/g, '');  // Remove remaining backslashes
-
-                    recommendations.innerHTML = `
-                        <div class="space-y-2 text-left">
-                            ${formattedMessage}
-                        </div>
-                    `;
-                } else {
-                    recommendations.innerHTML = `
+                if (!text) {
+                    showOutput();
+                    output.innerHTML = `
                         <div class="text-gray-500">
                             No recommendations available at this time.
                         </div>
@@ -67,6 +133,7 @@
                 }
 
             } catch (error) {
+                if (error.name === 'AbortError') return;
                 console.error('Error:', error); // Debug log
                 recommendations.classList.remove('hidden');
                 recommendations.innerHTML = `
@@ -75,9 +142,12 @@
                     </div>
                 `;
             } finally {
-                loading.classList.add('hidden');
-                askButton.disabled = false;
-                askButton.classList.remove('opacity-50');
+                if (currentStream === controller) {
+                    currentStream = null;
+                    loading.classList.add('hidden');
+                    askButton.disabled = false;
+                    askButton.classList.remove('opacity-50');
+                }
             }
         }
 
@@ -8,20 +8,29 @@ function checkAuth() {
     return token;
 }
 
-async function loadClosetItems() {
+// Items loaded so far and the cursor of the next page (null when there are no more)
+let loadedItems = [];
+let nextCursor = null;
+
+async function loadClosetItems(append = false) {
     const token = checkAuth();
     if (!token) return;
 
+    const params = new URLSearchParams({ limit: 50 });
+    if (append && nextCursor) params.append('cursor', nextCursor);
+
     try {
-        const response = await fetch('/api/closet/list', {
+        const response = await fetch(`/api/closet/list?${params}`, {
             headers: {
                 'Authorization': `Bearer ${token}`
             }
         });
 
         if (response.ok) {
-            const items = await response.json();
-            displayItems(items);
+            const page = await response.json();
+            loadedItems = append ? loadedItems.concat(page.items) : page.items;
+            nextCursor = page.next_cursor;
+            displayItems(loadedItems);
         } else if (response.status === 401) {
             localStorage.removeItem('authToken');
             window.location.href = '/login';
@@ -103,6 +112,14 @@ function displayItems(items) {
     });
 
     container.appendChild(scrollableWrapper); // Append the wrapper to the container
+
+    if (nextCursor) {
+        const loadMoreButton = document.createElement('button');
+        loadMoreButton.textContent = 'Load more';
+        loadMoreButton.className = 'mt-4 px-4 py-2 bg-white border border-black hover:bg-gray-200';
+        loadMoreButton.onclick = () => loadClosetItems(true);
+        container.appendChild(loadMoreButton);
+    }
 }
 
 // Handle logout
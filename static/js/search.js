@@ -33,7 +33,15 @@ async function handleSearch() {
         });
 
         if (response.ok) {
-            const results = await response.json();
+            const data = await response.json();
+            // Multi-brand searches answer {results, brands}
+            const results = Array.isArray(data) ? data : data.results;
+            if (!Array.isArray(data)) {
+                const missing = Object.entries(data.brands || {})
+                    .filter(([, status]) => status === 'timeout' || status === 'error')
+                    .map(([name]) => name);
+                if (missing.length) console.warn('Brands without results:', missing.join(', '));
+            }
             displaySearchResults(results, token);
         } else if (response.status === 401) {
             localStorage.removeItem('authToken');
@@ -364,6 +372,48 @@ function handleLogout() {
     window.location.href = '/login';
 }
 
+// Typeahead: offer popular queries while the user types
+function setupSuggestions() {
+    const input = document.getElementById('searchQuery');
+    if (!input) return;
+
+    const list = document.createElement('datalist');
+    list.id = 'searchSuggestions';
+    input.after(list);
+    input.setAttribute('list', list.id);
+    input.setAttribute('autocomplete', 'off');
+
+    let timeout;
+    let controller;
+    input.addEventListener('input', () => {
+        clearTimeout(timeout);
+        const prefix = input.value.trim();
+        if (!prefix) {
+            list.innerHTML = '';
+            return;
+        }
+        timeout = setTimeout(async () => {
+            // Only the answer to the latest keystroke matters
+            if (controller) controller.abort();
+            controller = new AbortController();
+            try {
+                const params = new URLSearchParams({ prefix, limit: 8 });
+                const response = await fetch(`/search/suggest?${params}`, { signal: controller.signal });
+                if (!response.ok) return;
+                const data = await response.json();
+                list.innerHTML = '';
+                data.suggestions.forEach(suggestion => {
+                    const option = document.createElement('option');
+                    option.value = suggestion;
+                    list.appendChild(option);
+                });
+            } catch (error) {
+                if (error.name !== 'AbortError') console.error('Suggestion error:', error);
+            }
+        }, 150);
+    });
+}
+
 // Initialize search page
 function init() {
     checkAuth();
@@ -371,6 +421,7 @@ function init() {
     if (logoutBtn) {
         logoutBtn.addEventListener('click', handleLogout);
     }
+    setupSuggestions();
 }
 
 async function handleWishlistAdd(product, token) {
@@ -8,20 +8,29 @@ function checkAuth() {
     return token;
 }
 
-async function loadWishlistItems() {
+// Items loaded so far and the cursor of the next page (null when there are no more)
+let loadedItems = [];
+let nextCursor = null;
+
+async function loadWishlistItems(append = false) {
     const token = checkAuth();
     if (!token) return;
 
+    const params = new URLSearchParams({ limit: 50 });
+    if (append && nextCursor) params.append('cursor', nextCursor);
+
     try {
-        const response = await fetch('/api/wishlist/list', {
+        const response = await fetch(`/api/wishlist/list?${params}`, {
             headers: {
                 'Authorization': `Bearer ${token}`
             }
         });
 
         if (response.ok) {
-            const items = await response.json();
-            displayItems(items);
+            const page = await response.json();
+            loadedItems = append ? loadedItems.concat(page.items) : page.items;
+            nextCursor = page.next_cursor;
+            displayItems(loadedItems);
         } else if (response.status === 401) {
             localStorage.removeItem('authToken');
             window.location.href = '/login';
@@ -115,6 +124,14 @@ function displayItems(items) {
     });
 
     container.appendChild(scrollableWrapper); // Append the wrapper to the main container
+
+    if (nextCursor) {
+        const loadMoreButton = document.createElement('button');
+        loadMoreButton.textContent = 'Load more';
+        loadMoreButton.className = 'mt-4 px-4 py-2 bg-white border border-black hover:bg-gray-200';
+        loadMoreButton.onclick = () => loadWishlistItems(true);
+        container.appendChild(loadMoreButton);
+    }
 }
 
 // Add the moveToCloset function
@@ -123,36 +140,24 @@ async function moveToCloset(item) {
     if (!token) return;
 
     try {
-        // First, add to closet
-        const addToClosetResponse = await fetch('/api/closet/add', {
+        // Add to closet and remove from wishlist in a single transaction
+        const response = await fetch('/api/wishlist/move-to-closet', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
                 'Authorization': `Bearer ${token}`
             },
-            body: JSON.stringify({
-                item_name: item.item_name,
-                item_description: item.item_description,
-                price: item.price
-            })
+            body: JSON.stringify({ item_ids: [item.item_id] })
         });
 
-        if (!addToClosetResponse.ok) {
-            const error = await addToClosetResponse.json();
-            throw new Error(error.detail || 'Failed to add item to closet');
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.detail || 'Failed to move item to closet');
         }
 
-        // Then, delete from wishlist
-        const deleteFromWishlistResponse = await fetch(`/api/wishlist/${item.item_id}`, {
-            method: 'DELETE',
-            headers: {
-                'Authorization': `Bearer ${token}`
-            }
-        });
-
-        if (!deleteFromWishlistResponse.ok) {
-            const error = await deleteFromWishlistResponse.json();
-            throw new Error(error.detail || 'Failed to remove item from wishlist');
+        const { results } = await response.json();
+        if (results[0].status !== 'moved') {
+            throw new Error('Item not found in wishlist');
         }
 
         // Reload the wishlist